@@ -0,0 +1,294 @@
+from sketch import load_sketch, sketch_quantiles
+
+
+def ensure_shop_price_summaries(db):
+    """
+    Create the shop x product alias summary table if it is missing.
+
+    The table is filled from existing price reports the first time it is
+    created; after that it is kept current by record_price_report and
+    record_quality_score.
+    """
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'shop_price_summaries'"
+    )
+    if exists:
+        return
+
+    db.execute(
+        "CREATE TABLE shop_price_summaries ("
+        "shop_id INTEGER NOT NULL, "
+        "product_alias_id INTEGER NOT NULL, "
+        "report_count INTEGER NOT NULL DEFAULT 0, "
+        "unit_price_sum REAL NOT NULL DEFAULT 0, "
+        "min_unit_price REAL, "
+        "max_unit_price REAL, "
+        "total_quantity INTEGER NOT NULL DEFAULT 0, "
+        "total_spent REAL NOT NULL DEFAULT 0, "
+        "quality_report_count INTEGER NOT NULL DEFAULT 0, "
+        "quality_score_sum REAL NOT NULL DEFAULT 0, "
+        "quality_score_count INTEGER NOT NULL DEFAULT 0, "
+        "earliest_report_date DATETIME, "
+        "latest_report_date DATETIME, "
+        "PRIMARY KEY (shop_id, product_alias_id), "
+        "FOREIGN KEY (shop_id) REFERENCES shops(id), "
+        "FOREIGN KEY (product_alias_id) REFERENCES product_aliases(id)"
+        ")"
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_shop_price_summaries_alias "
+        "ON shop_price_summaries (product_alias_id, shop_id)"
+    )
+    # The columns of this version only; later migrations fill their own
+    db.execute(
+        "INSERT INTO shop_price_summaries "
+        "(shop_id, product_alias_id, report_count, unit_price_sum, min_unit_price, max_unit_price, "
+        "total_quantity, total_spent, quality_report_count, quality_score_sum, quality_score_count, "
+        "earliest_report_date, latest_report_date) "
+        "SELECT pr.shop_id, pr.product_alias_id, COUNT(*), "
+        "SUM(pr.price_paid / pr.quantity), MIN(pr.price_paid / pr.quantity), MAX(pr.price_paid / pr.quantity), "
+        "SUM(pr.quantity), SUM(pr.price_paid), COUNT(qr.id), "
+        "COALESCE(SUM(qr.normalized_quality_score), 0), COUNT(qr.normalized_quality_score), "
+        "MIN(pr.reported_at), MAX(pr.reported_at) "
+        "FROM price_reports pr "
+        "LEFT JOIN quality_reports qr ON qr.price_report_id = pr.id "
+        "GROUP BY pr.shop_id, pr.product_alias_id"
+    )
+
+
+def ensure_shop_price_sketches(db):
+    """
+    Add the unit price quantile sketch to shop_price_summaries if it is
+    missing, and fill it from the existing price reports.
+    """
+    columns = {row['name'] for row in db.execute("SELECT name FROM pragma_table_info('shop_price_summaries')")}
+    if 'unit_price_sketch' not in columns:
+        db.execute("ALTER TABLE shop_price_summaries ADD COLUMN unit_price_sketch TEXT")
+    db.execute(
+        "UPDATE shop_price_summaries SET unit_price_sketch = ("
+        "SELECT quantile_sketch(pr.price_paid / pr.quantity) FROM price_reports pr "
+        "WHERE pr.shop_id = shop_price_summaries.shop_id "
+        "AND pr.product_alias_id = shop_price_summaries.product_alias_id"
+        ")"
+    )
+
+
+def ensure_shop_latest_prices(db):
+    """
+    Add the unit price of the latest report to shop_price_summaries if it
+    is missing, and fill it from the existing price reports.
+    """
+    columns = {row['name'] for row in db.execute("SELECT name FROM pragma_table_info('shop_price_summaries')")}
+    if 'latest_unit_price' not in columns:
+        db.execute("ALTER TABLE shop_price_summaries ADD COLUMN latest_unit_price REAL")
+    db.execute(
+        "UPDATE shop_price_summaries SET latest_unit_price = ("
+        "SELECT pr.price_paid / pr.quantity FROM price_reports pr "
+        "WHERE pr.shop_id = shop_price_summaries.shop_id "
+        "AND pr.product_alias_id = shop_price_summaries.product_alias_id "
+        "ORDER BY pr.reported_at DESC, pr.id DESC LIMIT 1"
+        ")"
+    )
+
+
+def rebuild_shop_price_summaries(db):
+    """Recompute every shop x product alias summary from the raw reports"""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        refill_shop_price_summaries(db)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+
+# Unit price of each shop x alias's latest report among the price_reports
+# matching {condition}; of reports made at the same time, the last inserted
+_LATEST_UNIT_PRICES = (
+    "(SELECT shop_id, product_alias_id, unit_price FROM ("
+    "SELECT shop_id, product_alias_id, price_paid / quantity AS unit_price, "
+    "ROW_NUMBER() OVER (PARTITION BY shop_id, product_alias_id ORDER BY reported_at DESC, id DESC) AS position "
+    "FROM price_reports WHERE {condition}"
+    ") WHERE position = 1) latest"
+)
+
+
+def refill_shop_price_summaries(db):
+    """
+    Replace the summaries with ones computed from the current price_reports.
+    Run it inside a transaction.
+    """
+    db.execute("DELETE FROM shop_price_summaries")
+    db.execute(
+        "INSERT INTO shop_price_summaries "
+        "(shop_id, product_alias_id, report_count, unit_price_sum, min_unit_price, max_unit_price, "
+        "total_quantity, total_spent, quality_report_count, quality_score_sum, quality_score_count, "
+        "earliest_report_date, latest_report_date, unit_price_sketch, latest_unit_price) "
+        "SELECT pr.shop_id, pr.product_alias_id, COUNT(*), "
+        "SUM(pr.price_paid / pr.quantity), MIN(pr.price_paid / pr.quantity), MAX(pr.price_paid / pr.quantity), "
+        "SUM(pr.quantity), SUM(pr.price_paid), COUNT(qr.id), "
+        "COALESCE(SUM(qr.normalized_quality_score), 0), COUNT(qr.normalized_quality_score), "
+        "MIN(pr.reported_at), MAX(pr.reported_at), quantile_sketch(pr.price_paid / pr.quantity), "
+        "MAX(latest.unit_price) "
+        "FROM price_reports pr "
+        f"JOIN {_LATEST_UNIT_PRICES.format(condition='1')} "
+        "USING (shop_id, product_alias_id) "
+        "LEFT JOIN quality_reports qr ON qr.price_report_id = pr.id "
+        "GROUP BY pr.shop_id, pr.product_alias_id"
+    )
+
+
+# The (upserted) latest unit price follows the newest report; the old
+# latest_report_date is compared, as every right-hand side reads the old row
+_LATEST_UNIT_PRICE_UPDATE = (
+    "latest_unit_price = CASE WHEN excluded.latest_report_date >= latest_report_date "
+    "THEN excluded.latest_unit_price ELSE latest_unit_price END"
+)
+
+
+def record_price_report(db, price_report_id):
+    """Fold a newly inserted price report into its shop x product alias summary"""
+    db.execute(
+        "INSERT INTO shop_price_summaries "
+        "(shop_id, product_alias_id, report_count, unit_price_sum, min_unit_price, max_unit_price, "
+        "total_quantity, total_spent, earliest_report_date, latest_report_date, unit_price_sketch, "
+        "latest_unit_price) "
+        "SELECT shop_id, product_alias_id, 1, price_paid / quantity, price_paid / quantity, price_paid / quantity, "
+        "quantity, price_paid, reported_at, reported_at, quantile_sketch(price_paid / quantity), "
+        "price_paid / quantity "
+        "FROM price_reports WHERE id = ? "
+        "GROUP BY shop_id, product_alias_id "
+        "ON CONFLICT (shop_id, product_alias_id) DO UPDATE SET "
+        "report_count = report_count + 1, "
+        "unit_price_sum = unit_price_sum + excluded.unit_price_sum, "
+        "min_unit_price = MIN(min_unit_price, excluded.min_unit_price), "
+        "max_unit_price = MAX(max_unit_price, excluded.max_unit_price), "
+        "total_quantity = total_quantity + excluded.total_quantity, "
+        "total_spent = total_spent + excluded.total_spent, "
+        "earliest_report_date = MIN(earliest_report_date, excluded.earliest_report_date), "
+        "latest_report_date = MAX(latest_report_date, excluded.latest_report_date), "
+        "unit_price_sketch = quantile_sketch_merge(unit_price_sketch, excluded.unit_price_sketch), "
+        + _LATEST_UNIT_PRICE_UPDATE,
+        price_report_id
+    )
+
+
+def record_price_reports_after(db, last_id):
+    """
+    Fold every price report with an id above last_id into the summaries.
+
+    Used by bulk imports, which insert a chunk of reports at once; run it
+    in the same transaction as the inserts.
+    """
+    db.execute(
+        "INSERT INTO shop_price_summaries "
+        "(shop_id, product_alias_id, report_count, unit_price_sum, min_unit_price, max_unit_price, "
+        "total_quantity, total_spent, earliest_report_date, latest_report_date, unit_price_sketch, "
+        "latest_unit_price) "
+        "SELECT pr.shop_id, pr.product_alias_id, COUNT(*), SUM(pr.price_paid / pr.quantity), "
+        "MIN(pr.price_paid / pr.quantity), MAX(pr.price_paid / pr.quantity), SUM(pr.quantity), SUM(pr.price_paid), "
+        "MIN(pr.reported_at), MAX(pr.reported_at), quantile_sketch(pr.price_paid / pr.quantity), "
+        "MAX(latest.unit_price) "
+        "FROM price_reports pr "
+        f"JOIN {_LATEST_UNIT_PRICES.format(condition='id > ?')} "
+        "USING (shop_id, product_alias_id) "
+        "WHERE pr.id > ? "
+        "GROUP BY pr.shop_id, pr.product_alias_id "
+        "ON CONFLICT (shop_id, product_alias_id) DO UPDATE SET "
+        "report_count = report_count + excluded.report_count, "
+        "unit_price_sum = unit_price_sum + excluded.unit_price_sum, "
+        "min_unit_price = MIN(min_unit_price, excluded.min_unit_price), "
+        "max_unit_price = MAX(max_unit_price, excluded.max_unit_price), "
+        "total_quantity = total_quantity + excluded.total_quantity, "
+        "total_spent = total_spent + excluded.total_spent, "
+        "earliest_report_date = MIN(earliest_report_date, excluded.earliest_report_date), "
+        "latest_report_date = MAX(latest_report_date, excluded.latest_report_date), "
+        "unit_price_sketch = quantile_sketch_merge(unit_price_sketch, excluded.unit_price_sketch), "
+        + _LATEST_UNIT_PRICE_UPDATE,
+        last_id,
+        last_id
+    )
+
+
+def record_quality_score(db, price_report_id, score, previous_score=None):
+    """
+    Fold a quality score into the summary of the report's shop x product alias.
+
+    previous_score is the score being replaced when an existing quality
+    report is updated; None means the quality report is new.
+    """
+    if previous_score is None:
+        db.execute(
+            "UPDATE shop_price_summaries SET "
+            "quality_report_count = quality_report_count + 1, "
+            "quality_score_sum = quality_score_sum + ?, "
+            "quality_score_count = quality_score_count + 1 "
+            "WHERE (shop_id, product_alias_id) = "
+            "(SELECT shop_id, product_alias_id FROM price_reports WHERE id = ?)",
+            score,
+            price_report_id
+        )
+    else:
+        db.execute(
+            "UPDATE shop_price_summaries SET "
+            "quality_score_sum = quality_score_sum + ? "
+            "WHERE (shop_id, product_alias_id) = "
+            "(SELECT shop_id, product_alias_id FROM price_reports WHERE id = ?)",
+            score - previous_score,
+            price_report_id
+        )
+
+
+def summary_stats(summary):
+    """
+    Grouped-search statistics from a shop_price_summaries row (or several
+    merged), with unit price percentiles read from its sketch
+    """
+    report_count = summary['report_count']
+    score_count = summary['quality_score_count']
+    percentiles = sketch_quantiles(
+        load_sketch(summary['unit_price_sketch']), summary['min_unit_price'], summary['max_unit_price']
+    )
+    return {
+        'report_count': report_count,
+        'avg_unit_price': round(summary['unit_price_sum'] / report_count, 2),
+        'min_unit_price': round(summary['min_unit_price'], 2),
+        'max_unit_price': round(summary['max_unit_price'], 2),
+        **{f'{name}_unit_price': value for name, value in percentiles.items()},
+        'total_quantity': summary['total_quantity'],
+        'total_spent': round(summary['total_spent'], 2),
+        'quality_report_count': summary['quality_report_count'],
+        'avg_quality_score': round(summary['quality_score_sum'] / score_count, 2) if score_count else None,
+        'latest_report_date': summary['latest_report_date'],
+        'earliest_report_date': summary['earliest_report_date'],
+    }
+
+
+def area_stats(summary):
+    """
+    Unit price statistics for a whole search area from shop_price_summaries
+    rows merged across shops: shop_count, report_count, unit_price_sum,
+    min/max_unit_price and the merged unit_price_sketch
+    """
+    report_count = summary['report_count'] or 0
+    if not report_count:
+        percentiles = sketch_quantiles({})
+        return {
+            'shop_count': summary['shop_count'] or 0,
+            'report_count': 0,
+            'avg_unit_price': None,
+            'min_unit_price': None,
+            'max_unit_price': None,
+            **{f'{name}_unit_price': value for name, value in percentiles.items()},
+        }
+    percentiles = sketch_quantiles(
+        load_sketch(summary['unit_price_sketch']), summary['min_unit_price'], summary['max_unit_price']
+    )
+    return {
+        'shop_count': summary['shop_count'],
+        'report_count': report_count,
+        'avg_unit_price': round(summary['unit_price_sum'] / report_count, 2),
+        'min_unit_price': round(summary['min_unit_price'], 2),
+        'max_unit_price': round(summary['max_unit_price'], 2),
+        **{f'{name}_unit_price': value for name, value in percentiles.items()},
+    }
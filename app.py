@@ -1,21 +1,75 @@
-from cs50 import SQL
+import csv
+import json
+import os
+import sys
+
+import click
 from flask import Flask, render_template
-from flask_session import Session
+from db import DATABASE, database_for, db
 from helpers import login_required
+from aggregates import rebuild_shop_price_summaries
+from archive import ALL_PRICE_REPORTS, ARCHIVE_AFTER_DAYS, archive_price_reports
+from migrations import apply_migrations, apply_migrations_once
+from export import EXPORT_FORMATS, iter_price_reports, parse_export_filters
+from outliers import rebuild_price_outliers
+from importer import CHUNK_ROWS, IMPORT_FIELDS, IMPORT_FORMATS, import_price_reports
+from trends import rebuild_price_report_daily
+from write_queue import GroupCommitWriter
+
+
+def create_app(config=None):
+    """
+    Build and configure the Flask app.
+
+    config overrides the defaults below. Nothing here touches the database:
+    connections open on first use, and pending migrations are applied
+    before the first request (with AUTO_MIGRATE) or by the CLI commands,
+    so the app can be created in a parent process before workers fork.
+    Each app keeps the Database for its own DATABASE path, so apps on
+    different files can live in one process.
+    """
+    from flask_session import Session
+    from routes import register_blueprints
 
-# Configure application
-app = Flask(__name__)
+    app = Flask(__name__)
+    app.config.update(
+        # Configure session to use filesystem (instead of signed cookies)
+        SESSION_PERMANENT=False,
+        SESSION_TYPE="filesystem",
+        DATABASE=DATABASE,
+        # Queue price report submissions for batched commits (see write_queue.py)
+        WRITE_BEHIND=os.environ.get("WRITE_BEHIND") == "1",
+        # A batch is committed once it holds this many reports, or once the
+        # first report has waited this long for others to join it
+        WRITE_BEHIND_MAX_BATCH=int(os.environ.get("WRITE_BEHIND_MAX_BATCH", 200)),
+        WRITE_BEHIND_MAX_DELAY_MS=float(os.environ.get("WRITE_BEHIND_MAX_DELAY_MS", 0)),
+        AUTO_MIGRATE=True,
+    )
+    if config:
+        app.config.update(config)
 
-# Configure session to use filesystem (instead of signed cookies)
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+    database = app.extensions["database"] = database_for(app.config["DATABASE"])
+    app.extensions["price_report_writer"] = GroupCommitWriter(
+        database,
+        max_batch=app.config["WRITE_BEHIND_MAX_BATCH"],
+        max_delay=app.config["WRITE_BEHIND_MAX_DELAY_MS"] / 1000
+    )
+    Session(app)
 
-# Configure CS50 Library to use SQLite database
-db = SQL("sqlite:///app.db")
+    if app.config["AUTO_MIGRATE"]:
+        # Bring the database schema up to date before any blueprint touches it
+        app.before_request(lambda: apply_migrations_once(database))
+    app.after_request(after_request)
+    # Hand each request's database connection back to the pool
+    app.teardown_appcontext(database.release)
+
+    app.add_url_rule("/", view_func=index)
+    for command in COMMANDS:
+        app.cli.add_command(command)
+    register_blueprints(app)
+    return app
 
 
-@app.after_request
 def after_request(response):
     """Ensure responses aren't cached"""
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
@@ -24,7 +78,6 @@ def after_request(response):
     return response
 
 
-@app.route("/")
 @login_required
 def index():
     """Home page with user statistics"""
@@ -33,9 +86,9 @@ def index():
     user_id = session.get("user_id")
     user_type = session.get("user_type")
     
-    # Get user's price report count
+    # Get user's price report count, archived reports included
     price_report_count = db.execute(
-        "SELECT COUNT(*) as count FROM price_reports WHERE user_id = ?",
+        f"SELECT COUNT(*) as count FROM {ALL_PRICE_REPORTS} pr WHERE pr.user_id = ?",
         user_id
     )[0]['count']
     
@@ -63,6 +116,132 @@ def index():
                          pending_aliases=pending_aliases)
 
 
-# Register blueprints
-from routes import register_blueprints
-register_blueprints(app)
\ No newline at end of file
+@click.command("migrate")
+@click.option("--plans", is_flag=True, help="Also print the recorded query plans")
+def migrate(plans):
+    """Apply pending schema migrations and list the applied ones"""
+    for migration in apply_migrations(db):
+        print(f"Applied migration {migration['version']}: {migration['name']}")
+    for row in db.execute("SELECT * FROM schema_version ORDER BY version"):
+        print(f"{row['version']:4}  {row['applied_at']}  {row['name']}")
+        if plans and row['plan_before']:
+            print("  before:\n    " + row['plan_before'].replace("\n", "\n    "))
+            print("  after:\n    " + row['plan_after'].replace("\n", "\n    "))
+
+
+@click.command("rebuild-summaries")
+def rebuild_summaries():
+    """Recompute the shop x product price summaries from all price reports"""
+    apply_migrations_once(db)
+    rebuild_shop_price_summaries(db)
+    count = db.execute("SELECT COUNT(*) AS count FROM shop_price_summaries")[0]['count']
+    print(f"Rebuilt {count} shop price summaries")
+
+
+@click.command("backfill-price-trends")
+def backfill_price_trends():
+    """Recompute the daily price rollup behind /api/price_trend from all price reports"""
+    apply_migrations_once(db)
+    rebuild_price_report_daily(db)
+    count = db.execute("SELECT COUNT(*) AS count FROM price_report_daily")[0]['count']
+    print(f"Rebuilt {count} daily price rollup rows")
+
+
+@click.command("rescore-price-reports")
+def rescore_price_reports():
+    """Recompute the running price statistics and suspect flags from all price reports"""
+    apply_migrations_once(db)
+    flagged = rebuild_price_outliers(db)
+    print(f"Flagged {flagged} suspect price reports")
+
+
+@click.command("archive-price-reports")
+@click.option("--older-than-days", type=click.IntRange(min=0), default=ARCHIVE_AFTER_DAYS, show_default=True)
+def archive_price_reports_command(older_than_days):
+    """Move old price reports out of the searched table into price_reports_archive"""
+    apply_migrations_once(db)
+    moved = archive_price_reports(db, older_than_days)
+    print(f"Archived {moved} price reports older than {older_than_days} days")
+
+
+@click.command("export-price-reports")
+@click.option("--format", "export_format", type=click.Choice(list(EXPORT_FORMATS)), default="ndjson")
+@click.option("--output", type=click.Path(dir_okay=False, writable=True), help="File to write (default: stdout)")
+@click.option("--category")
+@click.option("--product-alias-id")
+@click.option("--start-date", help="YYYY-MM-DD")
+@click.option("--end-date", help="YYYY-MM-DD, inclusive")
+@click.option("--min-lat")
+@click.option("--max-lat")
+@click.option("--min-lon")
+@click.option("--max-lon")
+def export_price_reports(export_format, output, **options):
+    """Stream price reports with shop, product and quality score as NDJSON or CSV"""
+    apply_migrations_once(db)
+    try:
+        filters = parse_export_filters(options)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    serialize = EXPORT_FORMATS[export_format][0]
+    out = open(output, "w", newline="", encoding="utf-8") if output else sys.stdout
+    try:
+        for chunk in serialize(iter_price_reports(filters)):
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+
+
+@click.command("import-price-reports")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--user", "username", required=True, help="Username the reports are attributed to")
+@click.option("--format", "import_format", type=click.Choice(list(IMPORT_FORMATS)), help="Default: from the file extension")
+@click.option("--rejects", type=click.Path(dir_okay=False, writable=True), help="Where to write rejected rows")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=CHUNK_ROWS, show_default=True)
+def import_price_reports_command(path, username, import_format, rejects, chunk_size):
+    """Bulk-import price reports from a CSV or JSONL file"""
+    apply_migrations_once(db)
+    user = db.execute("SELECT id FROM users WHERE username = ?", username)
+    if not user:
+        raise click.BadParameter(f"No user named {username}", param_hint="--user")
+
+    if not import_format:
+        import_format = "jsonl" if path.lower().endswith((".jsonl", ".ndjson")) else "csv"
+    if not rejects:
+        rejects = f"{path}.rejects.{import_format}"
+
+    with open(path, newline="", encoding="utf-8") as source, \
+            open(rejects, "w", newline="", encoding="utf-8") as rejected:
+        if import_format == "csv":
+            writer = csv.DictWriter(rejected, fieldnames=IMPORT_FIELDS + ("error",), extrasaction="ignore")
+            writer.writeheader()
+
+            def reject(row, error):
+                writer.writerow({**row, 'error': error})
+        else:
+            def reject(row, error):
+                rejected.write(json.dumps({**row, 'error': error}) + "\n")
+
+        def progress(stats):
+            rate = stats['imported'] / stats['seconds'] if stats['seconds'] else 0
+            print(f"{stats['read']} rows read, {stats['imported']} imported, "
+                  f"{stats['rejected']} rejected ({rate:,.0f} rows/s)", file=sys.stderr)
+
+        stats = import_price_reports(
+            db, IMPORT_FORMATS[import_format](source), user[0]['id'], reject, chunk_size, progress
+        )
+
+    print(f"Imported {stats['imported']} of {stats['read']} rows in {stats['seconds']:.1f}s; "
+          f"{stats['rejected']} rejected (see {rejects})")
+
+
+COMMANDS = (
+    migrate,
+    rebuild_summaries,
+    backfill_price_trends,
+    rescore_price_reports,
+    archive_price_reports_command,
+    export_price_reports,
+    import_price_reports_command,
+)
\ No newline at end of file
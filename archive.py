@@ -0,0 +1,150 @@
+import re
+
+from aggregates import refill_shop_price_summaries
+
+# Default age, in days, after which price reports move to the archive
+ARCHIVE_AFTER_DAYS = 180
+
+PRICE_REPORT_COLUMNS = "id, user_id, shop_id, product_alias_id, price_paid, quantity, reported_at"
+
+# Table expression covering hot and archived reports; use it in place of
+# price_reports, e.g. "FROM " + ALL_PRICE_REPORTS + " pr". SQLite pushes
+# WHERE conditions on pr into both halves, so each uses its own indexes.
+ALL_PRICE_REPORTS = (
+    f"(SELECT {PRICE_REPORT_COLUMNS} FROM price_reports "
+    f"UNION ALL SELECT {PRICE_REPORT_COLUMNS} FROM price_reports_archive)"
+)
+
+# Tables whose price_report_id points at any report, hot or archived
+PRICE_REPORT_CHILD_TABLES = ("quality_reports", "price_report_votes", "suspect_price_reports")
+
+
+def ensure_price_reports_archive(db):
+    """
+    Create the archive table for old price reports.
+
+    It has the same columns as price_reports and keeps the original ids,
+    so quality reports still point at their archived price report.
+    """
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS price_reports_archive ("
+        "id INTEGER PRIMARY KEY, "
+        "user_id INTEGER NOT NULL, "
+        "shop_id INTEGER NOT NULL, "
+        "product_alias_id INTEGER NOT NULL, "
+        "price_paid REAL NOT NULL, "
+        "quantity INTEGER NOT NULL DEFAULT 1, "
+        "reported_at DATETIME NOT NULL, "
+        "FOREIGN KEY (user_id) REFERENCES users(id), "
+        "FOREIGN KEY (shop_id) REFERENCES shops(id), "
+        "FOREIGN KEY (product_alias_id) REFERENCES product_aliases(id)"
+        ")"
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_price_reports_archive_alias_reported "
+        "ON price_reports_archive (product_alias_id, reported_at)"
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_price_reports_archive_user_reported "
+        "ON price_reports_archive (user_id, reported_at)"
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_price_reports_archive_reported "
+        "ON price_reports_archive (reported_at)"
+    )
+
+
+def ensure_price_report_ids(db):
+    """
+    Point the foreign keys of PRICE_REPORT_CHILD_TABLES at price_report_ids,
+    a table holding the id of every price report ever inserted, so rows of
+    archived reports keep a valid parent once the report leaves
+    price_reports.
+
+    A trigger adds each new price report's id. SQLite cannot alter a
+    foreign key, so each child table is rebuilt from its own CREATE
+    statement with only the referenced table changed, keeping its rows,
+    indexes and AUTOINCREMENT counter. Needs foreign key enforcement off
+    (apply_migrations does that), so dropping quality_reports does not
+    cascade to its details.
+    """
+    db.execute("CREATE TABLE IF NOT EXISTS price_report_ids (id INTEGER PRIMARY KEY)")
+    db.execute(
+        "CREATE TRIGGER IF NOT EXISTS price_report_ids_insert AFTER INSERT ON price_reports "
+        "BEGIN "
+        "INSERT OR IGNORE INTO price_report_ids (id) VALUES (NEW.id); "
+        "END"
+    )
+    db.execute(
+        "INSERT OR IGNORE INTO price_report_ids (id) "
+        "SELECT id FROM price_reports UNION ALL SELECT id FROM price_reports_archive"
+    )
+
+    for table in PRICE_REPORT_CHILD_TABLES:
+        sql = db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", table)[0]['sql']
+        repointed = re.sub(r"REFERENCES\s+price_reports\s*\(\s*id\s*\)", "REFERENCES price_report_ids(id)", sql)
+        if repointed == sql:
+            continue
+        extras = [row['sql'] for row in db.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+            table
+        )]
+        sequence = db.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", table)
+
+        db.execute(re.sub(r'^CREATE TABLE\s+"?\w+"?', f"CREATE TABLE {table}_new", repointed, count=1))
+        db.execute(f"INSERT INTO {table}_new SELECT * FROM {table}")
+        db.execute(f"DROP TABLE {table}")
+        db.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        for extra in extras:
+            db.execute(extra)
+        if sequence:
+            db.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", sequence[0]['seq'], table)
+
+        if db.execute(f"PRAGMA foreign_key_check({table})"):
+            raise RuntimeError(f"{table} has rows without a parent after repointing its foreign keys")
+
+
+def archive_price_reports(db, older_than_days=ARCHIVE_AFTER_DAYS):
+    """
+    Move price reports older than older_than_days into price_reports_archive
+    and recompute the shop summaries from the reports left behind, in one
+    transaction. Returns the number of reports moved.
+
+    Quality reports, votes and suspect flags keep referencing the moved
+    ids, whose parent row stays in price_report_ids (see
+    ensure_price_report_ids); price_reports ids are AUTOINCREMENT, so an
+    archived id is never handed out again.
+    """
+    cutoff = db.execute("SELECT datetime('now', ?) AS cutoff", f"-{older_than_days} days")[0]['cutoff']
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute(
+            f"INSERT INTO price_reports_archive ({PRICE_REPORT_COLUMNS}) "
+            f"SELECT {PRICE_REPORT_COLUMNS} FROM price_reports WHERE reported_at < ?",
+            cutoff
+        )
+        moved = db.execute("DELETE FROM price_reports WHERE reported_at < ?", cutoff)
+        if moved:
+            refill_shop_price_summaries(db)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return moved
+
+
+def price_reports_source(db, include_archive=False, start_date=None, end_date=None):
+    """
+    Table expression to read price reports from: price_reports alone, or
+    ALL_PRICE_REPORTS when the archive is asked for or a date range
+    reaches back into it.
+    """
+    if include_archive:
+        return ALL_PRICE_REPORTS
+    if start_date is None and end_date is None:
+        return "price_reports"
+    archived_until = db.execute("SELECT MAX(reported_at) AS latest FROM price_reports_archive")[0]['latest']
+    if archived_until is not None and (start_date is None or start_date.isoformat() <= archived_until):
+        return ALL_PRICE_REPORTS
+    return "price_reports"
@@ -0,0 +1,256 @@
+import math
+
+from geo import bounding_box
+from outliers import SUSPECT_REPORT_IDS
+
+# Most distinct product aliases in one basket
+MAX_BASKET_ITEMS = 20
+
+# Most shops a plan may split a basket across
+MAX_BASKET_SHOPS = 4
+
+# Costs closer than this count as equal, so a plan with more shops must
+# save at least a cent
+COST_EPSILON = 0.005
+
+
+# Shop x alias pairs with a suspect price report among them
+_FLAGGED_PAIRS = (
+    "SELECT pr.shop_id, pr.product_alias_id FROM suspect_price_reports sp "
+    "JOIN price_reports pr ON pr.id = sp.price_report_id"
+)
+
+# Latest report that is not suspect, for each flagged pair of the wanted
+# aliases; every other pair's latest report is the summary's latest_unit_price
+_CLEAN_LATEST_PRICES = (
+    "(SELECT shop_id, product_alias_id, unit_price, reported_at FROM ("
+    "SELECT shop_id, product_alias_id, price_paid / quantity AS unit_price, reported_at, "
+    "ROW_NUMBER() OVER (PARTITION BY shop_id, product_alias_id ORDER BY reported_at DESC, id DESC) AS position "
+    "FROM price_reports "
+    f"WHERE id NOT IN {SUSPECT_REPORT_IDS} "
+    "AND product_alias_id IN (?) "
+    f"AND (shop_id, product_alias_id) IN ({_FLAGGED_PAIRS})"
+    ") WHERE position = 1) clean"
+)
+
+
+def load_basket_prices(db, product_alias_ids, lat, lon, radius, max_age_days=None):
+    """
+    Latest unit price of each wanted alias at every shop within radius km,
+    from the shop price summaries. Returns {shop_id: shop} where each shop
+    has its details, distance and prices {alias_id: (unit_price, reported_at)}.
+    Suspect reports are passed over for the latest one that is not, and
+    prices last reported more than max_age_days ago are left out.
+    """
+    age_sql = ""
+    args = []
+    if max_age_days is not None:
+        age_sql = "AND COALESCE(clean.reported_at, sps.latest_report_date) >= datetime('now', ?) "
+        args.append(f"-{max_age_days} days")
+
+    rows = db.execute(
+        "SELECT s.id AS shop_id, s.name AS shop_name, s.address, s.latitude, s.longitude, "
+        "haversine(?, ?, s.latitude, s.longitude) AS distance, "
+        "sps.product_alias_id, pa.alias_name, "
+        "COALESCE(clean.unit_price, sps.latest_unit_price) AS unit_price, "
+        "COALESCE(clean.reported_at, sps.latest_report_date) AS reported_at "
+        "FROM shops_rtree r "
+        "JOIN shops s ON s.id = r.id "
+        "JOIN shop_price_summaries sps ON sps.shop_id = s.id "
+        "JOIN product_aliases pa ON pa.id = sps.product_alias_id "
+        f"LEFT JOIN {_CLEAN_LATEST_PRICES} "
+        "ON clean.shop_id = sps.shop_id AND clean.product_alias_id = sps.product_alias_id "
+        "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+        "AND sps.product_alias_id IN (?) "
+        "AND distance <= ? "
+        f"AND (clean.unit_price IS NOT NULL OR (sps.shop_id, sps.product_alias_id) NOT IN ({_FLAGGED_PAIRS})) "
+        + age_sql,
+        lat,
+        lon,
+        list(product_alias_ids),
+        *bounding_box(lat, lon, radius),
+        list(product_alias_ids),
+        radius,
+        *args
+    )
+
+    shops = {}
+    for row in rows:
+        shop = shops.get(row['shop_id'])
+        if shop is None:
+            shop = shops[row['shop_id']] = {
+                'shop_id': row['shop_id'],
+                'shop_name': row['shop_name'],
+                'address': row['address'],
+                'latitude': row['latitude'],
+                'longitude': row['longitude'],
+                'distance': round(row['distance'], 2),
+                'prices': {},
+                'alias_names': {},
+            }
+        shop['prices'][row['product_alias_id']] = (row['unit_price'], row['reported_at'])
+        shop['alias_names'][row['product_alias_id']] = row['alias_name']
+    return shops
+
+
+def drop_dominated(costs):
+    """
+    Indexes of the shops worth considering, given costs[shop][item]: a shop
+    is dropped when another is no dearer for every item, and cheaper for
+    one or earlier in order, since swapping it in never makes a plan worse.
+    """
+    import numpy as np
+
+    costs = np.asarray(costs, dtype=float)
+    order = np.arange(len(costs))
+    kept = []
+    for i, own in enumerate(costs):
+        no_dearer = (costs <= own).all(axis=1)
+        dominates = no_dearer & ((costs < own).any(axis=1) | (order < i))
+        dominates[i] = False
+        if not dominates.any():
+            kept.append(i)
+    return kept
+
+
+def cheapest_shop_set(costs, size, upper=math.inf):
+    """
+    Branch and bound for the set of at most size shops minimizing the total
+    of each item's cheapest cost among them, with costs[shop][item] (inf
+    where a shop has no price). Only sets with every item and a total below
+    upper are returned, as (total, [shop indexes]); None if there is none.
+
+    Shops are tried in order, and a partial set is dropped when even its
+    best completion cannot beat the best total so far, bounded two ways:
+    using every shop still to come at once (those minima only grow along
+    the order, so the rest of a loop is skipped once it fails), and
+    subtracting the largest savings any single remaining shop would give
+    once per open slot, since savings of shops together never exceed the
+    sum of their own.
+    """
+    import numpy as np
+
+    costs = np.asarray(costs, dtype=float)
+    count, items = costs.shape
+    # A missing price costs more than any complete basket, keeping the
+    # arithmetic finite; totals at or above it lack an item
+    missing = 2 * sum(float(column[np.isfinite(column)].max(initial=0.0)) for column in costs.T) + 1
+    costs = np.where(np.isfinite(costs), costs, missing)
+    suffix = np.minimum.accumulate(costs[::-1], axis=0)[::-1]
+
+    best = [min(upper, missing), None]
+
+    def visit(start, chosen, current):
+        slots = size - len(chosen)
+        totals = np.minimum(current, costs[start:]).sum(axis=1)
+        if slots == 1:
+            j = int(totals.argmin())
+            if totals[j] < best[0] - COST_EPSILON:
+                best[0], best[1] = float(totals[j]), chosen + [start + j]
+            return
+
+        savings = np.sort(current.sum() - totals)[::-1]
+        if current.sum() - savings[:slots].sum() >= best[0] - COST_EPSILON:
+            return
+        for j in range(start, count):
+            if np.minimum(current, suffix[j]).sum() >= best[0] - COST_EPSILON:
+                break
+            if totals[j - start] < best[0] - COST_EPSILON:
+                best[0], best[1] = float(totals[j - start]), chosen + [j]
+            if j + 1 < count:
+                visit(j + 1, chosen + [j], np.minimum(current, costs[j]))
+
+    visit(0, [], np.full(items, missing))
+    return None if best[1] is None else (best[0], best[1])
+
+
+def plan_basket(db, items, lat, lon, radius, max_shops=1, max_age_days=None):
+    """
+    Cheapest way to buy a basket of {product_alias_id: quantity} at the
+    shops within radius km, using each shop's latest unit prices that are
+    not suspect.
+
+    Returns the best plan for each number of shops up to max_shops that
+    saves money over fewer shops, cheapest (and largest) last; each plan
+    lists its shops with the items bought at each. Aliases no nearby shop
+    has a price for are listed as unavailable and planned without.
+    """
+    shops = load_basket_prices(db, items, lat, lon, radius, max_age_days)
+    available = {alias_id for shop in shops.values() for alias_id in shop['prices']}
+    wanted = [alias_id for alias_id in items if alias_id in available]
+    result = {
+        'plans': [],
+        'unavailable': [alias_id for alias_id in items if alias_id not in available],
+        'candidate_shops': len(shops),
+        'considered_shops': 0,
+    }
+    if not wanted:
+        return result
+
+    # Shops covering more of the basket, then cheaper, then nearer come
+    # first, so good plans are found early and bound the rest
+    def rank(shop):
+        covered = [shop['prices'][a][0] * items[a] for a in wanted if a in shop['prices']]
+        return (-len(covered), sum(covered), shop['distance'], shop['shop_id'])
+
+    ordered = sorted(shops.values(), key=rank)
+    costs = [
+        [shop['prices'][a][0] * items[a] if a in shop['prices'] else math.inf for a in wanted]
+        for shop in ordered
+    ]
+    kept = drop_dominated(costs)
+    ordered = [ordered[i] for i in kept]
+    costs = [costs[i] for i in kept]
+    result['considered_shops'] = len(ordered)
+
+    # Nothing beats buying every item wherever it is cheapest
+    lowest = sum(min(column) for column in zip(*costs))
+    best_total = math.inf
+    for size in range(1, max_shops + 1):
+        found = cheapest_shop_set(costs, size, best_total)
+        if found is None:
+            continue
+        best_total, indexes = found
+        result['plans'].append(describe_plan([ordered[i] for i in indexes], wanted, items))
+        if best_total <= lowest + COST_EPSILON:
+            break
+    return result
+
+
+def describe_plan(shops, wanted, items):
+    """A plan buying each wanted alias at the cheapest of shops"""
+    plan_shops = {shop['shop_id']: [] for shop in shops}
+    by_id = {shop['shop_id']: shop for shop in shops}
+    total = 0.0
+    for alias_id in wanted:
+        shop = min(
+            (shop for shop in shops if alias_id in shop['prices']),
+            key=lambda shop: (shop['prices'][alias_id][0], shop['distance'])
+        )
+        unit_price, reported_at = shop['prices'][alias_id]
+        cost = unit_price * items[alias_id]
+        total += cost
+        plan_shops[shop['shop_id']].append({
+            'product_alias_id': alias_id,
+            'alias_name': shop['alias_names'][alias_id],
+            'quantity': items[alias_id],
+            'unit_price': round(unit_price, 2),
+            'cost': round(cost, 2),
+            'price_reported_at': reported_at,
+        })
+
+    # A shop left without items would not be needed for this total
+    plan_shops = {shop_id: bought for shop_id, bought in plan_shops.items() if bought}
+    return {
+        'shop_count': len(plan_shops),
+        'total_cost': round(total, 2),
+        'shops': [
+            {
+                **{key: by_id[shop_id][key] for key in
+                   ('shop_id', 'shop_name', 'address', 'latitude', 'longitude', 'distance')},
+                'subtotal': round(sum(item['cost'] for item in bought), 2),
+                'items': bought,
+            }
+            for shop_id, bought in plan_shops.items()
+        ],
+    }
@@ -0,0 +1,105 @@
+"""
+Time the basket planner over hundreds of nearby shops against trying every
+combination of shops, and check both find the same total.
+
+Adds generated shops and reports to a temporary copy of app.db. Run from
+the project folder:
+
+    python benchmarks/bench_basket.py [shop_count] [basket_size]
+"""
+import io
+import itertools
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from basket import load_basket_prices, plan_basket
+from db import DATABASE, Database
+from importer import import_price_reports, read_csv_rows
+from migrations import apply_migrations
+
+CENTRE = (23.78, 90.40)
+RADIUS_KM = 15
+
+
+def add_shops(db, count, rng):
+    """Insert count shops within RADIUS_KM of CENTRE; returns their ids"""
+    db.executemany(
+        "INSERT INTO shops (name, address, latitude, longitude) VALUES (?, ?, ?, ?)",
+        [
+            (f"Bench shop {i}", "Dhaka", CENTRE[0] + rng.uniform(-0.1, 0.1), CENTRE[1] + rng.uniform(-0.1, 0.1))
+            for i in range(count)
+        ]
+    )
+    return [row['id'] for row in db.execute("SELECT id FROM shops WHERE name LIKE 'Bench shop %'")]
+
+
+def make_csv(shops, aliases, rng):
+    """Reports for most aliases at each shop, each alias around its own base price"""
+    base = {alias: rng.uniform(50, 5000) for alias in aliases}
+    lines = ["shop_id,product_alias_id,price_paid,quantity"]
+    for shop in shops:
+        for alias in aliases:
+            if rng.random() < 0.7:
+                for _ in range(rng.randint(1, 3)):
+                    lines.append(f"{shop},{alias},{base[alias] * rng.uniform(0.8, 1.25):.2f},1")
+    return "\n".join(lines) + "\n"
+
+
+def brute_force(db, items, size):
+    """Lowest total over every set of up to size shops"""
+    shops = list(load_basket_prices(db, items, *CENTRE, RADIUS_KM).values())
+    best = math.inf
+    for count in range(1, size + 1):
+        for combination in itertools.combinations(shops, count):
+            total = 0.0
+            for alias, quantity in items.items():
+                total += min(
+                    (shop['prices'][alias][0] for shop in combination if alias in shop['prices']), default=math.inf
+                ) * quantity
+            best = min(best, total)
+    return best
+
+
+def main():
+    shop_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    basket_size = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        shutil.copy(DATABASE, path)
+        db = Database(path)
+        apply_migrations(db)
+        aliases = [row['id'] for row in db.execute("SELECT id FROM product_aliases ORDER BY id LIMIT ?", basket_size)]
+        shops = add_shops(db, shop_count, rng)
+        import_price_reports(db, read_csv_rows(io.StringIO(make_csv(shops, aliases, rng))), 1, lambda row, error: None)
+        items = {alias: rng.randint(1, 3) for alias in aliases}
+
+        for max_shops in (1, 2, 3):
+            result = plan_basket(db, items, *CENTRE, RADIUS_KM, max_shops)
+            best = min(plan['total_cost'] for plan in result['plans'])
+            print(f"max_shops={max_shops}: {result['candidate_shops']} candidate shops, "
+                  f"{result['considered_shops']} after dominance, best total {best:.2f} "
+                  f"with {result['plans'][-1]['shop_count']} shops")
+            planner = min(timeit.repeat(
+                lambda: plan_basket(db, items, *CENTRE, RADIUS_KM, max_shops), number=1, repeat=5
+            ))
+            line = f"  planner {planner * 1000:9.2f} ms"
+            if max_shops <= 2:
+                started = timeit.default_timer()
+                exhaustive = brute_force(db, items, max_shops)
+                line += f"   every combination {(timeit.default_timer() - started) * 1000:9.2f} ms"
+                assert abs(exhaustive - best) < 0.01, (exhaustive, best)
+            print(line)
+        db.release()
+
+
+if __name__ == "__main__":
+    main()
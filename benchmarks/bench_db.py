@@ -0,0 +1,64 @@
+"""
+Time the per-query overhead of the sqlite3 executor in db.py, and compare
+it with cs50.SQL when the cs50 package is installed (it is no longer a
+requirement: pip install cs50 to include it).
+
+Runs the kind of small queries the index, quality report and admin routes
+issue, against a temporary copy of app.db. Run from the project folder:
+
+    python benchmarks/bench_db.py [iterations]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DATABASE, Database
+
+try:
+    from cs50 import SQL
+except ImportError:
+    SQL = None
+
+QUERIES = (
+    ("SELECT COUNT(*) AS count FROM price_reports WHERE user_id = ?", 1),
+    ("SELECT user_type FROM users WHERE id = ?", 1),
+    ("SELECT * FROM quality_reports WHERE price_report_id = ?", 2),
+    ("SELECT * FROM shops WHERE id IN (?)", [1, 2, 3]),
+    ("UPDATE users SET username = username WHERE id = ?", 1),
+)
+
+
+def run_queries(db):
+    for sql, arg in QUERIES:
+        db.execute(sql, arg)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        shutil.copy(DATABASE, path)
+
+        databases = [("db.Database", Database(path))]
+        if SQL is None:
+            print("cs50 is not installed; timing db.Database only")
+        else:
+            cs50_db = SQL(f"sqlite:///{path}")
+            # Results must match before timings mean anything
+            for sql, arg in QUERIES:
+                assert cs50_db.execute(sql, arg) == databases[0][1].execute(sql, arg), sql
+            databases.insert(0, ("cs50.SQL", cs50_db))
+
+        queries = iterations * len(QUERIES)
+        for name, db in databases:
+            seconds = min(timeit.repeat(lambda: run_queries(db), number=iterations, repeat=3))
+            print(f"{name:12} {seconds / queries * 1e6:8.1f} us/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure bulk price report import throughput.
+
+Imports generated CSV rows (shops and aliases given by name) into a
+temporary copy of app.db. Run from the project folder:
+
+    python benchmarks/bench_import.py [row_count]
+"""
+import csv
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DATABASE, Database
+from importer import import_price_reports, read_csv_rows
+from migrations import apply_migrations
+
+
+def make_csv(db, count, seed=0):
+    """CSV text of random reports against the existing shops and aliases"""
+    rng = random.Random(seed)
+    shops = [row['name'] for row in db.execute("SELECT name FROM shops")]
+    aliases = [row['alias_name'] for row in db.execute("SELECT alias_name FROM product_aliases")]
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(("shop", "alias", "price_paid", "quantity", "reported_at"))
+    for _ in range(count):
+        writer.writerow((
+            rng.choice(shops),
+            rng.choice(aliases),
+            f"{rng.uniform(10, 50000):.2f}",
+            rng.randint(1, 10),
+            f"2026-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+        ))
+    return out.getvalue()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        shutil.copy(DATABASE, path)
+        db = Database(path)
+        apply_migrations(db)
+
+        rejected = []
+        stats = import_price_reports(
+            db,
+            read_csv_rows(io.StringIO(make_csv(db, count))),
+            1,
+            lambda row, error: rejected.append(error),
+        )
+        db.release()
+
+    print(f"{stats['imported']} imported, {stats['rejected']} rejected in {stats['seconds']:.2f}s "
+          f"({stats['imported'] / stats['seconds']:,.0f} rows/s)")
+    if rejected:
+        print("first rejection:", rejected[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Time a year-long price trend query from the daily rollup against
+computing the same medians from the raw price reports.
+
+Imports a year of generated reports into a temporary copy of app.db.
+Run from the project folder:
+
+    python benchmarks/bench_price_trend.py [row_count]
+"""
+import io
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import timeit
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DATABASE, Database
+from importer import import_price_reports, read_csv_rows
+from migrations import apply_migrations
+from trends import price_trend
+
+ALIAS_ID = 1
+END = date(2026, 9, 30)
+START = END - timedelta(days=364)
+
+
+def make_csv(db, count, seed=0):
+    """CSV text of reports for ALIAS_ID and two other aliases, spread over a year"""
+    rng = random.Random(seed)
+    shops = [row['id'] for row in db.execute("SELECT id FROM shops")]
+    aliases = [row['id'] for row in db.execute("SELECT id FROM product_aliases LIMIT 3")]
+    lines = ["shop_id,product_alias_id,price_paid,quantity,reported_at"]
+    for _ in range(count):
+        day = START + timedelta(days=rng.randrange(365))
+        lines.append(f"{rng.choice(shops)},{rng.choice(aliases)},{rng.uniform(100, 500):.2f},1,"
+                     f"{day.isoformat()} {rng.randrange(24):02}:00:00")
+    return "\n".join(lines) + "\n"
+
+
+def raw_trend(db):
+    """The daily trend computed straight from price_reports"""
+    days = {}
+    for row in db.execute(
+        "SELECT date(reported_at) AS day, price_paid / quantity AS unit_price FROM price_reports "
+        "WHERE product_alias_id = ? AND reported_at >= ? AND reported_at < ?",
+        ALIAS_ID, START.isoformat(), (END + timedelta(days=1)).isoformat()
+    ):
+        days.setdefault(row['day'], []).append(row['unit_price'])
+    return [
+        {'period': day, 'count': len(prices), 'median': statistics.median(prices), 'mean': statistics.fmean(prices),
+         'min': min(prices), 'max': max(prices)}
+        for day, prices in sorted(days.items())
+    ]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    repeat = 20
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        shutil.copy(DATABASE, path)
+        db = Database(path)
+        apply_migrations(db)
+        import_price_reports(db, read_csv_rows(io.StringIO(make_csv(db, count))), 1, lambda row, error: None)
+        db.execute("ANALYZE")
+
+        rollup_rows = db.execute(
+            "SELECT COUNT(*) AS count FROM price_report_daily WHERE product_alias_id = ?", ALIAS_ID
+        )[0]['count']
+        print(f"{count} reports imported; {rollup_rows} rollup rows for alias {ALIAS_ID}")
+
+        daily = price_trend(db, ALIAS_ID, 'day', START, END)
+        assert [point['median'] for point in daily] == [round(point['median'], 2) for point in raw_trend(db)]
+
+        for name, run in (
+            ("rollup, daily", lambda: price_trend(db, ALIAS_ID, 'day', START, END)),
+            ("rollup, weekly", lambda: price_trend(db, ALIAS_ID, 'week', START, END)),
+            ("raw reports, daily", lambda: raw_trend(db)),
+        ):
+            best = min(timeit.repeat(run, number=1, repeat=repeat))
+            print(f"{name:20} {best * 1000:8.2f} ms")
+        db.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Measure cold start: importing app.py and calling create_app() in a fresh
+interpreter, using python -X importtime.
+
+Run from the project folder:
+
+    python benchmarks/bench_startup.py [runs]
+
+Prints the median time to a created app, the slowest imports and any
+deferred module that was imported anyway. Exits with status 1 if the
+median is over STARTUP_BUDGET_MS or a deferred module was imported, so it
+can gate a deploy.
+"""
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start budget for import + create_app(), in milliseconds
+STARTUP_BUDGET_MS = 500
+
+# Modules only needed by some requests; importing them at startup is a regression
+DEFERRED_MODULES = ("numpy",)
+
+SCRIPT = (
+    "import sys, time\n"
+    "started = time.perf_counter()\n"
+    "from app import create_app\n"
+    "create_app()\n"
+    "print((time.perf_counter() - started) * 1000)\n"
+    "print(','.join(name for name in {deferred!r} if name in sys.modules))\n"
+)
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run_once():
+    """(milliseconds to a created app, {module: cumulative us}, deferred modules imported)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCRIPT.format(deferred=DEFERRED_MODULES)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    elapsed, imported = result.stdout.splitlines()[-2:]
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2))
+    return float(elapsed), cumulative, [name for name in imported.split(",") if name]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    timings = []
+    slowest = {}
+    imported = set()
+    for _ in range(runs):
+        elapsed, cumulative, deferred = run_once()
+        timings.append(elapsed)
+        imported.update(deferred)
+        for module, us in cumulative.items():
+            slowest.setdefault(module, []).append(us)
+
+    median = statistics.median(timings)
+    print(f"create_app() cold start: median {median:.0f} ms, min {min(timings):.0f} ms "
+          f"over {runs} runs (budget {STARTUP_BUDGET_MS} ms)")
+    print("slowest imports (median cumulative):")
+    ranked = sorted(((statistics.median(us), module) for module, us in slowest.items()), reverse=True)
+    for us, module in ranked[:15]:
+        print(f"  {us / 1000:8.1f} ms  {module}")
+
+    failed = False
+    if imported:
+        print("deferred modules imported at startup:", ", ".join(sorted(imported)))
+        failed = True
+    if median > STARTUP_BUDGET_MS:
+        print("over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare concurrent price report inserts with and without the group-commit
+write queue, against a temporary copy of app.db.
+
+Run from the project folder:
+
+    python benchmarks/bench_write_queue.py [threads] [reports_per_thread]
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DATABASE, Database
+from migrations import apply_migrations
+from submissions import save_price_report
+from write_queue import GroupCommitWriter
+
+REPORT = {'shop_id': 1, 'product_alias_id': 1, 'price_paid': 100.0, 'quantity': 1}
+
+
+def run(threads, per_thread, submit):
+    """Submit reports from several threads; returns (seconds, per-report latencies in ms)"""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        mine = []
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            submit()
+            mine.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started, latencies
+
+
+def report(name, seconds, latencies):
+    latencies.sort()
+    print(f"{name:22} {len(latencies) / seconds:8,.0f} reports/s   "
+          f"p50 {statistics.median(latencies):6.2f} ms   p99 {latencies[int(len(latencies) * 0.99)]:6.2f} ms")
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        shutil.copy(DATABASE, path)
+        db = Database(path)
+        apply_migrations(db)
+        db.release()
+
+        for synchronous in ("NORMAL", "FULL"):
+            def direct():
+                if db.execute("PRAGMA synchronous")[0]['synchronous'] != {"NORMAL": 1, "FULL": 2}[synchronous]:
+                    db.execute(f"PRAGMA synchronous = {synchronous}")
+                save_price_report(db, 1, REPORT)
+
+            report(f"direct ({synchronous.lower()})", *run(threads, per_thread, direct))
+
+        writer = GroupCommitWriter(db)
+        report("group commit (full)", *run(threads, per_thread, lambda: writer.submit(1, REPORT)))
+        stats = writer.stats()
+        print(f"  {stats['batches']} batches, {stats['avg_batch_size']} reports/batch, "
+              f"{stats['avg_flush_ms']} ms/flush")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import datetime
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+
+from flask import current_app, has_app_context
+
+from geo import haversine_distance
+from sketch import register_sketch_functions
+
+DATABASE = "app.db"
+
+# Idle connections kept for reuse once a request is done with them
+POOL_SIZE = 8
+
+# Prepared statements cached per connection by the sqlite3 module
+STATEMENT_CACHE_SIZE = 256
+
+# Applied to every connection when it is opened
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", 5000),
+    ("foreign_keys", "ON"),
+    ("cache_size", -16000),  # KiB, i.e. 16 MB per connection
+    ("mmap_size", 256 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+)
+
+# String literals, quoted identifiers and comments are skipped when
+# looking for ? placeholders
+_PLACEHOLDER = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|\?", re.DOTALL)
+
+# Bind dates the way cs50.SQL did, so stored values keep their format
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda value: value.strftime("%Y-%m-%d %H:%M:%S"))
+
+_stats_lock = threading.Lock()
+_stats = {
+    'connections_opened': 0,
+    'readonly_connections_opened': 0,
+}
+
+
+def configure_connection(connection):
+    """Apply the shared pragmas and SQL functions to a raw sqlite3 connection"""
+    cursor = connection.cursor()
+    for name, value in PRAGMAS:
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+    connection.create_function("haversine", 4, haversine_distance, deterministic=True)
+    register_sketch_functions(connection)
+
+
+def dict_factory(cursor, row):
+    """Row factory returning plain dicts keyed by column name"""
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
+@lru_cache(maxsize=512)
+def _statement_kind(sql):
+    """First keyword of a statement, upper-cased"""
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+
+
+@lru_cache(maxsize=512)
+def _expand_placeholders(sql, shape):
+    """
+    Rewrite sql so the placeholder at each position with a length in shape
+    becomes that many comma-separated placeholders (for IN (?) with a list).
+    """
+    position = -1
+
+    def replace(match):
+        nonlocal position
+        if match.group() != "?":
+            return match.group()
+        position += 1
+        if shape[position] is None:
+            return "?"
+        return ", ".join("?" * shape[position]) or "NULL"
+
+    return _PLACEHOLDER.sub(replace, sql)
+
+
+def _flatten(sql, args):
+    """Expand list and tuple arguments into one placeholder per element"""
+    if not any(isinstance(arg, (list, tuple)) for arg in args):
+        return sql, args
+    shape = tuple(len(arg) if isinstance(arg, (list, tuple)) else None for arg in args)
+    flat = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            flat.extend(arg)
+        else:
+            flat.append(arg)
+    return _expand_placeholders(sql, shape), flat
+
+
+class Database:
+    """
+    Thin executor over the stdlib sqlite3 module with the cs50.SQL call shape.
+
+    db.execute(sql, *args) returns a list of dicts for statements that
+    produce rows, the new row id for an INSERT of one row (None otherwise),
+    the number of affected rows for UPDATE and DELETE, and True for
+    anything else. List arguments expand for IN (?). Constraint violations
+    raise ValueError and other database errors RuntimeError, as with cs50.
+
+    Each thread uses its own connection in autocommit mode, so an explicit
+    BEGIN ... COMMIT only ever spans that thread's statements. release()
+    hands the connection back to a small idle pool for the next request.
+    """
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._local = threading.local()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._checked_out = 0
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        connection.row_factory = dict_factory
+        configure_connection(connection)
+        with _stats_lock:
+            _stats['connections_opened'] += 1
+        return connection
+
+    def connection(self):
+        """The calling thread's connection, taken from the idle pool or opened"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+                self._checked_out += 1
+            if connection is None:
+                connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    def release(self, exception=None):
+        """
+        Return the calling thread's connection to the idle pool.
+
+        Registered as an app context teardown; an unfinished transaction
+        is rolled back first.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return
+        self._local.connection = None
+        if connection.in_transaction:
+            connection.rollback()
+        with self._lock:
+            self._checked_out -= 1
+            if len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def execute(self, sql, *args):
+        """Run one statement and return its result in the cs50.SQL style"""
+        sql, args = _flatten(sql, args)
+        try:
+            cursor = self.connection().execute(sql, args)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(str(e)) from None
+        except sqlite3.Error as e:
+            raise RuntimeError(str(e)) from None
+
+        if cursor.description is not None:
+            return cursor.fetchall()
+        kind = _statement_kind(sql)
+        if kind in ("INSERT", "REPLACE"):
+            return cursor.lastrowid if cursor.rowcount == 1 else None
+        if kind in ("UPDATE", "DELETE"):
+            return cursor.rowcount
+        return True
+
+    def executemany(self, sql, seq_of_args):
+        """Run one statement for every argument tuple; returns the affected row count"""
+        try:
+            cursor = self.connection().executemany(sql, seq_of_args)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(str(e)) from None
+        except sqlite3.Error as e:
+            raise RuntimeError(str(e)) from None
+        return cursor.rowcount
+
+    def stats(self):
+        """Pool counters for monitoring"""
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'idle': len(self._idle),
+                'checked_out': self._checked_out,
+            }
+
+
+def connect_readonly():
+    """
+    Open a separate read-only connection with the shared configuration.
+
+    Used for long streaming reads that should not hold the request's
+    connection; the caller closes it.
+    """
+    connection = sqlite3.connect(f"file:{db.path}?mode=ro", uri=True, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    connection.execute(f"PRAGMA busy_timeout = {dict(PRAGMAS)['busy_timeout']}")
+    connection.execute(f"PRAGMA mmap_size = {dict(PRAGMAS)['mmap_size']}")
+    connection.create_function("haversine", 4, haversine_distance, deterministic=True)
+    register_sketch_functions(connection)
+    with _stats_lock:
+        _stats['readonly_connections_opened'] += 1
+    return connection
+
+
+def pool_stats():
+    """Connection counters and the state of the connection pool"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update(db.stats())
+    return stats
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def database_for(path):
+    """The Database for a file, shared by every app configured with that path"""
+    with _databases_lock:
+        database = _databases.get(path)
+        if database is None:
+            database = _databases[path] = Database(path)
+        return database
+
+
+class CurrentDatabase:
+    """
+    Stands in for the Database of the current Flask app (set up by
+    create_app in app.extensions['database']), or of DATABASE outside an
+    app context, so modules can import one db while each app keeps its own.
+    """
+
+    def _target(self):
+        if has_app_context():
+            return current_app.extensions['database']
+        return database_for(DATABASE)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+# The handle the app and every blueprint use. Each thread (and so each
+# request) gets its own connection from the current app's Database, opened
+# on first use and handed back to the pool when the app context is torn down.
+db = CurrentDatabase()
@@ -0,0 +1,150 @@
+import csv
+import io
+import json
+import math
+from datetime import datetime, timedelta
+
+from archive import ALL_PRICE_REPORTS
+from db import connect_readonly
+
+CATEGORIES = ('electronics', 'pharma', 'apparel', 'food')
+
+EXPORT_COLUMNS = (
+    'id', 'reported_at', 'price_paid', 'quantity', 'unit_price',
+    'shop_id', 'shop_name', 'address', 'latitude', 'longitude',
+    'product_alias_id', 'alias_name', 'product_id', 'canonical_name', 'category',
+    'quality_score', 'scoring_version',
+)
+
+# Rows written per chunk of the streamed response
+CHUNK_ROWS = 500
+
+
+def parse_export_filters(args):
+    """
+    Validate export filters from a mapping of strings (query args or CLI options).
+
+    Returns a dict with any of category, product_alias_id, start_date,
+    end_date and bbox (min_lat, max_lat, min_lon, max_lon). Raises
+    ValueError with a user-facing message on bad input.
+    """
+    filters = {}
+
+    category = args.get('category')
+    if category:
+        if category not in CATEGORIES:
+            raise ValueError("Invalid category")
+        filters['category'] = category
+
+    product_alias_id = args.get('product_alias_id')
+    if product_alias_id:
+        try:
+            filters['product_alias_id'] = int(product_alias_id)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid product alias id")
+
+    for name in ('start_date', 'end_date'):
+        value = args.get(name)
+        if value:
+            try:
+                filters[name] = datetime.strptime(value, "%Y-%m-%d").date()
+            except (ValueError, TypeError):
+                raise ValueError(f"{name} must be YYYY-MM-DD")
+
+    bbox_names = ('min_lat', 'max_lat', 'min_lon', 'max_lon')
+    bbox_values = [args.get(name) for name in bbox_names]
+    if any(v not in (None, '') for v in bbox_values):
+        try:
+            filters['bbox'] = tuple(float(v) for v in bbox_values)
+        except (ValueError, TypeError):
+            raise ValueError("Bounding box needs numeric min_lat, max_lat, min_lon and max_lon")
+        if not all(math.isfinite(v) for v in filters['bbox']):
+            raise ValueError("Bounding box needs numeric min_lat, max_lat, min_lon and max_lon")
+
+    return filters
+
+
+def iter_price_reports(filters):
+    """
+    Yield price reports, archived ones included, joined with shop, alias,
+    product and quality score as dicts.
+
+    Rows come straight off a read-only SQLite cursor, so memory use does not
+    grow with the number of reports exported.
+    """
+    joins = ""
+    conditions = []
+    args = []
+
+    if 'bbox' in filters:
+        min_lat, max_lat, min_lon, max_lon = filters['bbox']
+        joins = "JOIN shops_rtree r ON r.id = s.id "
+        conditions.append("r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?")
+        args.extend([min_lat, max_lat, min_lon, max_lon])
+    if 'category' in filters:
+        conditions.append("p.category = ?")
+        args.append(filters['category'])
+    if 'product_alias_id' in filters:
+        conditions.append("pr.product_alias_id = ?")
+        args.append(filters['product_alias_id'])
+    if 'start_date' in filters:
+        conditions.append("pr.reported_at >= ?")
+        args.append(filters['start_date'].isoformat())
+    if 'end_date' in filters:
+        conditions.append("pr.reported_at < ?")
+        args.append((filters['end_date'] + timedelta(days=1)).isoformat())
+
+    sql = (
+        "SELECT pr.id, pr.reported_at, pr.price_paid, pr.quantity, "
+        "pr.price_paid / pr.quantity AS unit_price, "
+        "s.id AS shop_id, s.name AS shop_name, s.address, s.latitude, s.longitude, "
+        "pa.id AS product_alias_id, pa.alias_name, p.id AS product_id, p.canonical_name, p.category, "
+        "qr.normalized_quality_score AS quality_score, qr.scoring_version "
+        f"FROM {ALL_PRICE_REPORTS} pr "
+        "JOIN shops s ON pr.shop_id = s.id "
+        + joins
+        + "JOIN product_aliases pa ON pr.product_alias_id = pa.id "
+        "JOIN products p ON pa.product_id = p.id "
+        "LEFT JOIN quality_reports qr ON qr.price_report_id = pr.id "
+        + ("WHERE " + " AND ".join(conditions) + " " if conditions else "")
+        + "ORDER BY pr.id"
+    )
+
+    connection = connect_readonly()
+    try:
+        for row in connection.execute(sql, args):
+            yield dict(row)
+    finally:
+        connection.close()
+
+
+def ndjson_chunks(rows):
+    """Serialize rows as newline-delimited JSON, a chunk of lines at a time"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, separators=(",", ":")))
+        if len(lines) >= CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def csv_chunks(rows):
+    """Serialize rows as CSV with a header line, a chunk of lines at a time"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_chunks, "application/x-ndjson"),
+    'csv': (csv_chunks, "text/csv"),
+}
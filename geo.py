@@ -0,0 +1,75 @@
+import math
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two points in kilometers using Haversine formula"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lon = math.radians(lon2 - lon1)
+
+    a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return EARTH_RADIUS_KM * c
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Return (min_lat, max_lat, min_lon, max_lon) enclosing a circle of radius_km.
+
+    The box is a cheap superset of the circle, used to pick candidate shops
+    from the spatial index before the exact haversine check.
+    """
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(lat - delta_lat, -90.0)
+    max_lat = min(lat + delta_lat, 90.0)
+
+    # Longitude degrees shrink towards the poles; widen the box accordingly
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat < 1e-12:
+        return min_lat, max_lat, -180.0, 180.0
+    delta_lon = min(math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)), 180.0)
+
+    return min_lat, max_lat, lon - delta_lon, lon + delta_lon
+
+
+def ensure_shop_spatial_index(db):
+    """
+    Create the R*Tree index over shops.latitude/longitude if it is missing.
+
+    Triggers keep the index in sync whenever a shop is inserted (e.g. on
+    proposal approval), moved or deleted, and any shops that predate the
+    index are backfilled.
+    """
+    db.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS shops_rtree USING rtree("
+        "id, min_lat, max_lat, min_lon, max_lon)"
+    )
+    db.execute(
+        "CREATE TRIGGER IF NOT EXISTS shops_rtree_insert AFTER INSERT ON shops "
+        "BEGIN "
+        "INSERT INTO shops_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+        "VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude); "
+        "END"
+    )
+    db.execute(
+        "CREATE TRIGGER IF NOT EXISTS shops_rtree_update AFTER UPDATE OF latitude, longitude ON shops "
+        "BEGIN "
+        "UPDATE shops_rtree SET min_lat = NEW.latitude, max_lat = NEW.latitude, "
+        "min_lon = NEW.longitude, max_lon = NEW.longitude WHERE id = NEW.id; "
+        "END"
+    )
+    db.execute(
+        "CREATE TRIGGER IF NOT EXISTS shops_rtree_delete AFTER DELETE ON shops "
+        "BEGIN "
+        "DELETE FROM shops_rtree WHERE id = OLD.id; "
+        "END"
+    )
+    db.execute(
+        "INSERT INTO shops_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+        "SELECT s.id, s.latitude, s.latitude, s.longitude, s.longitude FROM shops s "
+        "WHERE s.id NOT IN (SELECT id FROM shops_rtree)"
+    )
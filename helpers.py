@@ -1,3 +1,6 @@
+import base64
+import json
+import math
 import re
 from flask import redirect, render_template, session
 from functools import wraps
@@ -163,3 +166,56 @@ def score_apparel(report: dict) -> float:
 
 def is_admin(user):
     return user['user_type'] == 'admin'
+
+
+def encode_search_cursor(distance: float, report_id: int) -> str:
+    """
+    Encode the last (distance, report id) of a search page as an opaque token.
+    """
+    payload = json.dumps([distance, report_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(token: str):
+    """
+    Decode a token from encode_search_cursor.
+    Returns (distance, report_id), or None if the token is malformed.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        distance, report_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(distance), int(report_id)
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def parse_price_report(shop_id, product_alias_id, price_paid, quantity="1") -> dict:
+    """
+    Validate the fields of a price report given as strings (form or import row).
+    Returns a dict of typed values; raises ValueError with a user-facing message.
+    """
+    if not shop_id:
+        raise ValueError("Must select a shop")
+    if not product_alias_id:
+        raise ValueError("Must select a product")
+    if not price_paid:
+        raise ValueError("Must provide price paid")
+
+    try:
+        report = {
+            'shop_id': int(shop_id),
+            'product_alias_id': int(product_alias_id),
+            'price_paid': float(price_paid),
+            'quantity': int(quantity),
+        }
+    except (ValueError, TypeError):
+        raise ValueError("Invalid input data")
+
+    # float() accepts 'inf' and 'nan', and NaN fails every comparison
+    if not math.isfinite(report['price_paid']):
+        raise ValueError("Invalid input data")
+    if report['price_paid'] <= 0:
+        raise ValueError("Price must be positive")
+    if report['quantity'] <= 0:
+        raise ValueError("Quantity must be positive")
+    return report
@@ -0,0 +1,169 @@
+import csv
+import json
+import time
+from datetime import datetime
+
+from aggregates import record_price_reports_after
+from helpers import parse_price_report
+from outliers import score_price_reports_after
+from trends import record_price_report_days_after
+
+# Price reports inserted per transaction
+CHUNK_ROWS = 5000
+
+# Columns understood in an import file. Shops and aliases may be given by id
+# or by name; reported_at defaults to the time of the import.
+IMPORT_FIELDS = ('shop_id', 'shop', 'product_alias_id', 'alias', 'price_paid', 'quantity', 'reported_at')
+
+
+def read_csv_rows(file):
+    """Yield (row, error) pairs from a CSV file with a header line"""
+    for row in csv.DictReader(file):
+        yield row, None
+
+
+def read_jsonl_rows(file):
+    """Yield (row, error) pairs from a file with one JSON object per line"""
+    for line in file:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield {'raw': line.rstrip("\n")}, "Invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield {'raw': line.rstrip("\n")}, "Each line must be a JSON object"
+            continue
+        yield {key: "" if value is None else str(value) for key, value in row.items()}, None
+
+
+IMPORT_FORMATS = {
+    'csv': read_csv_rows,
+    'jsonl': read_jsonl_rows,
+}
+
+
+def _name_key(name):
+    return " ".join(name.split()).casefold()
+
+
+def load_lookups(db):
+    """
+    In-memory maps for resolving import rows: known shop and alias ids, and
+    normalized names to ids. A name shared by several rows maps to None.
+    """
+    lookups = {
+        'shop_ids': set(),
+        'shops_by_name': {},
+        'alias_ids': set(),
+        'aliases_by_name': {},
+    }
+    for shop in db.execute("SELECT id, name FROM shops"):
+        lookups['shop_ids'].add(shop['id'])
+        key = _name_key(shop['name'])
+        lookups['shops_by_name'][key] = None if key in lookups['shops_by_name'] else shop['id']
+    for alias in db.execute("SELECT id, alias_name FROM product_aliases"):
+        lookups['alias_ids'].add(alias['id'])
+        key = _name_key(alias['alias_name'])
+        lookups['aliases_by_name'][key] = None if key in lookups['aliases_by_name'] else alias['id']
+    return lookups
+
+
+def _resolve_name(row, id_field, name_field, by_name, label):
+    """Return the row's id field, or the id its name field maps to"""
+    if row.get(id_field) or not row.get(name_field):
+        return row.get(id_field)
+    key = _name_key(row[name_field])
+    if key not in by_name:
+        raise ValueError(f"Unknown {label} '{row[name_field]}'")
+    if by_name[key] is None:
+        raise ValueError(f"Ambiguous {label} '{row[name_field]}', give its id instead")
+    return str(by_name[key])
+
+
+def resolve_row(row, lookups):
+    """
+    Turn an import row into insert parameters
+    (shop_id, product_alias_id, price_paid, quantity, reported_at).
+
+    Applies the same checks as the price report form, plus existence of the
+    shop and alias. Raises ValueError with the reason a row is rejected.
+    """
+    shop_id = _resolve_name(row, 'shop_id', 'shop', lookups['shops_by_name'], "shop")
+    alias_id = _resolve_name(row, 'product_alias_id', 'alias', lookups['aliases_by_name'], "product alias")
+    report = parse_price_report(shop_id, alias_id, row.get('price_paid'), row.get('quantity') or "1")
+
+    if report['shop_id'] not in lookups['shop_ids']:
+        raise ValueError(f"Unknown shop id {report['shop_id']}")
+    if report['product_alias_id'] not in lookups['alias_ids']:
+        raise ValueError(f"Unknown product alias id {report['product_alias_id']}")
+
+    reported_at = None
+    if row.get('reported_at'):
+        try:
+            reported_at = datetime.fromisoformat(row['reported_at'].strip()).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            raise ValueError("reported_at must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS")
+
+    return (report['shop_id'], report['product_alias_id'], report['price_paid'], report['quantity'], reported_at)
+
+
+def insert_chunk(db, user_id, chunk):
+    """Insert resolved rows, flag outliers and fold them into the summaries and daily rollup in one transaction"""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        last_id = db.execute("SELECT COALESCE(MAX(id), 0) AS id FROM price_reports")[0]['id']
+        db.executemany(
+            "INSERT INTO price_reports (user_id, shop_id, product_alias_id, price_paid, quantity, reported_at) "
+            "VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+            [(user_id, *row) for row in chunk]
+        )
+        score_price_reports_after(db, last_id)
+        record_price_reports_after(db, last_id)
+        record_price_report_days_after(db, last_id)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+
+def import_price_reports(db, rows, user_id, reject, chunk_size=CHUNK_ROWS, progress=None):
+    """
+    Validate and insert price reports from (row, error) pairs.
+
+    Rejected rows are passed to reject(row, reason). After each committed
+    chunk, progress(stats) is called if given. Returns the final stats:
+    rows read, imported and rejected, and elapsed seconds.
+    """
+    lookups = load_lookups(db)
+    stats = {'read': 0, 'imported': 0, 'rejected': 0, 'seconds': 0.0}
+    started = time.perf_counter()
+    chunk = []
+
+    def flush():
+        insert_chunk(db, user_id, chunk)
+        stats['imported'] += len(chunk)
+        stats['seconds'] = time.perf_counter() - started
+        chunk.clear()
+        if progress:
+            progress(stats)
+
+    for row, error in rows:
+        stats['read'] += 1
+        if error is None:
+            try:
+                chunk.append(resolve_row(row, lookups))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            stats['rejected'] += 1
+            reject(row, error)
+            continue
+        if len(chunk) >= chunk_size:
+            flush()
+
+    if chunk:
+        flush()
+    stats['seconds'] = time.perf_counter() - started
+    return stats
@@ -0,0 +1,165 @@
+import threading
+
+from aggregates import ensure_shop_latest_prices, ensure_shop_price_sketches, ensure_shop_price_summaries
+from archive import ensure_price_report_ids, ensure_price_reports_archive
+from geo import ensure_shop_spatial_index
+from outliers import ensure_price_outliers
+from quality import ensure_quality_report_details, ensure_quality_report_scores, ensure_quality_report_updated_at
+from submissions import ensure_idempotency_keys
+from trends import ensure_price_report_daily
+
+
+def add_search_indexes(db):
+    """Indexes behind the nearby-price search (newest-first and cheapest-first)"""
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_price_reports_alias_reported "
+        "ON price_reports (product_alias_id, reported_at)"
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_price_reports_alias_unit_price "
+        "ON price_reports (product_alias_id, price_paid / quantity)"
+    )
+
+
+def add_hot_path_indexes(db):
+    """
+    Indexes for the homepage counts, the user's own reports and the admin
+    review queues.
+
+    price_reports(product_alias_id) needs no index of its own: it is the
+    leading column of idx_price_reports_alias_reported.
+    """
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_price_reports_user_reported "
+        "ON price_reports (user_id, reported_at)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_quality_reports_user ON quality_reports (user_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_shop_proposals_status ON shop_proposals (status)")
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_product_alias_proposals_status "
+        "ON product_alias_proposals (status)"
+    )
+
+
+# (version, name, function, probe queries). Functions run inside the
+# migration's transaction, so they must not BEGIN or COMMIT themselves,
+# with foreign key enforcement off so tables can be rebuilt. The probe
+# queries' plans are recorded before and after.
+MIGRATIONS = (
+    (1, "shop spatial index", ensure_shop_spatial_index, ()),
+    (2, "quality score on quality_reports", ensure_quality_report_scores, ()),
+    (3, "shop price summaries", ensure_shop_price_summaries, ()),
+    (4, "price report search indexes", add_search_indexes, (
+        ("SELECT id FROM price_reports WHERE product_alias_id = ? ORDER BY reported_at DESC", 1),
+        ("SELECT id FROM price_reports WHERE product_alias_id = ? ORDER BY price_paid / quantity", 1),
+    )),
+    (5, "hot path indexes", add_hot_path_indexes, (
+        ("SELECT COUNT(*) FROM price_reports WHERE user_id = ?", 1),
+        ("SELECT id FROM price_reports WHERE user_id = ? ORDER BY reported_at DESC", 1),
+        ("SELECT COUNT(*) FROM quality_reports WHERE user_id = ?", 1),
+        ("SELECT * FROM shop_proposals WHERE status = 'pending'",),
+        ("SELECT * FROM product_alias_proposals WHERE status = 'pending'",),
+    )),
+    (6, "updated_at on quality_reports", ensure_quality_report_updated_at, ()),
+    (7, "batch submission idempotency keys", ensure_idempotency_keys, ()),
+    (8, "price report archive", ensure_price_reports_archive, ()),
+    (9, "consolidated quality report details", ensure_quality_report_details, ()),
+    (10, "daily price rollup", ensure_price_report_daily, ()),
+    (11, "unit price sketches on shop price summaries", ensure_shop_price_sketches, ()),
+    (12, "running price statistics and suspect price reports", ensure_price_outliers, ()),
+    (13, "latest unit price on shop price summaries", ensure_shop_latest_prices, ()),
+    (14, "price report foreign keys cover archived reports", ensure_price_report_ids, ()),
+)
+
+
+def query_plans(db, probes):
+    """EXPLAIN QUERY PLAN output for each probe query, as one block of text"""
+    blocks = []
+    for sql, *args in probes:
+        plan = db.execute("EXPLAIN QUERY PLAN " + sql, *args)
+        blocks.append("\n".join([sql] + ["  " + step['detail'] for step in plan]))
+    return "\n".join(blocks) or None
+
+
+def ensure_schema_version(db):
+    """Create the table recording applied migrations if it is missing"""
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, "
+        "name TEXT NOT NULL, "
+        "plan_before TEXT, "
+        "plan_after TEXT, "
+        "applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP"
+        ")"
+    )
+
+
+def pending_migrations(db):
+    """Migrations not yet recorded in schema_version, in order"""
+    ensure_schema_version(db)
+    applied = {row['version'] for row in db.execute("SELECT version FROM schema_version")}
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def apply_migrations(db):
+    """
+    Apply every pending migration in version order.
+
+    Each migration runs in one transaction with its schema_version row, so
+    a failed migration leaves no trace and is retried whole next time.
+    Foreign keys are not enforced while migrations run; a migration that
+    rebuilds tables checks their foreign keys itself.
+    Returns the schema_version rows written, one per applied migration.
+    """
+    applied = []
+    # Has no effect inside a transaction, so it is set around them
+    db.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for version, name, migrate, probes in pending_migrations(db):
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have applied it while this one waited
+                if db.execute("SELECT 1 FROM schema_version WHERE version = ?", version):
+                    db.execute("COMMIT")
+                    continue
+                plan_before = query_plans(db, probes)
+                migrate(db)
+                plan_after = query_plans(db, probes)
+                db.execute(
+                    "INSERT INTO schema_version (version, name, plan_before, plan_after) VALUES (?, ?, ?, ?)",
+                    version,
+                    name,
+                    plan_before,
+                    plan_after
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            applied.append({
+                'version': version,
+                'name': name,
+                'plan_before': plan_before,
+                'plan_after': plan_after,
+            })
+    finally:
+        db.execute("PRAGMA foreign_keys = ON")
+    return applied
+
+
+# Paths of the database files already migrated in this process
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def apply_migrations_once(db):
+    """
+    apply_migrations the first time it is called for db's file in this
+    process; later calls return straight away. Runs before the first request.
+    """
+    if db.path in _migrated:
+        return
+    with _migrate_lock:
+        if db.path not in _migrated:
+            apply_migrations(db)
+            _migrated.add(db.path)
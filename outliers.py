@@ -0,0 +1,188 @@
+import math
+
+from archive import ALL_PRICE_REPORTS
+
+# Each product alias keeps a running count, mean and sum of squared
+# deviations (Welford) of the log of its unit prices, so a new report is
+# scored in O(1). Logs make typos and wrong quantities, which are off by a
+# factor, stand out the same way at any price level.
+
+# A report is suspect when its log unit price is more than OUTLIER_Z
+# standard deviations from its alias's running mean
+OUTLIER_Z = 4.0
+
+# Reports an alias needs before new ones are scored
+MIN_SCORED_REPORTS = 10
+
+# Smallest standard deviation used (about 5% in price), so an alias whose
+# reports all had one price does not flag every small change
+MIN_LOG_STDDEV = 0.05
+
+# Ids of suspect reports, for "pr.id IN ..." / "NOT IN ..." conditions
+SUSPECT_REPORT_IDS = "(SELECT price_report_id FROM suspect_price_reports)"
+
+
+def ensure_price_outliers(db):
+    """
+    Create the per-alias running price statistics and the table of suspect
+    price reports if they are missing, filled by replaying every existing
+    report (archived ones included) in id order.
+    """
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'price_alias_stats'"
+    )
+    if exists:
+        return
+
+    db.execute(
+        "CREATE TABLE price_alias_stats ("
+        "product_alias_id INTEGER PRIMARY KEY, "
+        "report_count INTEGER NOT NULL, "
+        "log_mean REAL NOT NULL, "
+        "log_m2 REAL NOT NULL, "
+        "FOREIGN KEY (product_alias_id) REFERENCES product_aliases(id)"
+        ")"
+    )
+    # Flags are rare, so searches exclude them with NOT IN over this table
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS suspect_price_reports ("
+        "price_report_id INTEGER PRIMARY KEY, "
+        "z_score REAL NOT NULL, "
+        "flagged_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+        "FOREIGN KEY (price_report_id) REFERENCES price_reports(id)"
+        ")"
+    )
+    refill_price_outliers(db)
+
+
+def score_unit_price(stats, unit_price):
+    """
+    Score a unit price against an alias's (count, mean, m2) statistics.
+
+    Returns (z, value) where z is the log price's z-score, or None while
+    the alias has fewer than MIN_SCORED_REPORTS reports, and value is the
+    log price to fold into the statistics: suspect prices are clamped to
+    OUTLIER_Z deviations so one typo barely moves the mean, while a real
+    price change still shifts it.
+    """
+    count, mean, m2 = stats
+    value = math.log(unit_price)
+    if count < MIN_SCORED_REPORTS:
+        return None, value
+    stddev = max(math.sqrt(m2 / (count - 1)), MIN_LOG_STDDEV)
+    z = (value - mean) / stddev
+    if abs(z) > OUTLIER_Z:
+        value = mean + math.copysign(OUTLIER_Z * stddev, z)
+    return z, value
+
+
+def fold_log_price(stats, value):
+    """(count, mean, m2) after adding one log price"""
+    count, mean, m2 = stats
+    delta = value - mean
+    count += 1
+    mean += delta / count
+    return count, mean, m2 + delta * (value - mean)
+
+
+def _replay(rows, stats):
+    """
+    Score (id, product_alias_id, unit_price) rows in order, updating stats
+    ({alias: (count, mean, m2)}) in place; returns the suspect (id, z) pairs
+    """
+    flags = []
+    for row in rows:
+        alias_stats = stats.get(row['product_alias_id'], (0, 0.0, 0.0))
+        z, value = score_unit_price(alias_stats, row['unit_price'])
+        if z is not None and abs(z) > OUTLIER_Z:
+            flags.append((row['id'], z))
+        stats[row['product_alias_id']] = fold_log_price(alias_stats, value)
+    return flags
+
+
+def rebuild_price_outliers(db):
+    """Recompute the running statistics and suspect flags by replaying all price reports"""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        flagged = refill_price_outliers(db)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return flagged
+
+
+def refill_price_outliers(db):
+    """
+    Replace the running statistics and suspect flags with a replay of all
+    price reports. Run it inside a transaction. Returns the number flagged.
+    """
+    stats = {}
+    flags = _replay(db.execute(
+        f"SELECT id, product_alias_id, price_paid / quantity AS unit_price FROM {ALL_PRICE_REPORTS} ORDER BY id"
+    ), stats)
+    db.execute("DELETE FROM price_alias_stats")
+    db.execute("DELETE FROM suspect_price_reports")
+    db.executemany("INSERT INTO suspect_price_reports (price_report_id, z_score) VALUES (?, ?)", flags)
+    db.executemany(
+        "INSERT INTO price_alias_stats (product_alias_id, report_count, log_mean, log_m2) VALUES (?, ?, ?, ?)",
+        [(alias_id, *alias_stats) for alias_id, alias_stats in stats.items()]
+    )
+    return len(flags)
+
+
+def score_price_report(db, price_report_id, product_alias_id, unit_price):
+    """
+    Score a newly inserted price report against its alias's running
+    statistics, flag it if suspect and fold it in. Returns True if flagged.
+    """
+    rows = db.execute(
+        "SELECT report_count, log_mean, log_m2 FROM price_alias_stats WHERE product_alias_id = ?",
+        product_alias_id
+    )
+    stats = (rows[0]['report_count'], rows[0]['log_mean'], rows[0]['log_m2']) if rows else (0, 0.0, 0.0)
+    z, value = score_unit_price(stats, unit_price)
+    suspect = z is not None and abs(z) > OUTLIER_Z
+    if suspect:
+        db.execute("INSERT INTO suspect_price_reports (price_report_id, z_score) VALUES (?, ?)", price_report_id, z)
+
+    # One statement, so concurrent reports for an alias cannot lose an
+    # update: the right-hand sides all read the old row
+    db.execute(
+        "INSERT INTO price_alias_stats (product_alias_id, report_count, log_mean, log_m2) VALUES (?, 1, ?, 0.0) "
+        "ON CONFLICT (product_alias_id) DO UPDATE SET "
+        "report_count = report_count + 1, "
+        "log_mean = log_mean + (excluded.log_mean - log_mean) / (report_count + 1), "
+        "log_m2 = log_m2 + (excluded.log_mean - log_mean) * (excluded.log_mean - log_mean) "
+        "* report_count / (report_count + 1)",
+        product_alias_id,
+        value
+    )
+    return suspect
+
+
+def score_price_reports_after(db, last_id):
+    """
+    Score every price report with an id above last_id in id order; the
+    bulk import counterpart of score_price_report. Call it inside the
+    import's transaction. Returns the number flagged.
+    """
+    rows = db.execute(
+        "SELECT id, product_alias_id, price_paid / quantity AS unit_price FROM price_reports "
+        "WHERE id > ? ORDER BY id",
+        last_id
+    )
+    if not rows:
+        return 0
+    stats = {row['product_alias_id']: (row['report_count'], row['log_mean'], row['log_m2']) for row in db.execute(
+        "SELECT * FROM price_alias_stats WHERE product_alias_id IN (?)",
+        list({row['product_alias_id'] for row in rows})
+    )}
+    flags = _replay(rows, stats)
+    db.executemany("INSERT INTO suspect_price_reports (price_report_id, z_score) VALUES (?, ?)", flags)
+    db.executemany(
+        "INSERT OR REPLACE INTO price_alias_stats (product_alias_id, report_count, log_mean, log_m2) "
+        "VALUES (?, ?, ?, ?)",
+        [(alias_id, *alias_stats) for alias_id, alias_stats in stats.items()]
+    )
+    return len(flags)
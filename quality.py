@@ -0,0 +1,275 @@
+from aggregates import record_quality_score
+from helpers import score_apparel, score_electronics, score_food, score_pharma
+
+# Version tag stored with every normalized quality score
+SCORING_VERSION = "v1.0"
+
+# Fields of each category's quality detail: (name, type, required). Optional
+# integers default to NULL and optional text to an empty string.
+QUALITY_FIELDS = {
+    'electronics': (
+        ('device_functional', int, True),
+        ('authenticity_confidence', int, True),
+        ('condition_match', int, True),
+        ('warranty_honored', int, False),
+        ('accessories_complete', int, True),
+        ('reported_issue', str, False),
+    ),
+    'pharma': (
+        ('packaging_sealed', int, True),
+        ('expiry_date_present', int, True),
+        ('expiry_status', str, True),
+        ('label_completeness', str, True),
+        ('dosage_label_matches_expected', int, True),
+        ('physical_anomalies_present', int, True),
+        ('evidence_photos', str, False),
+    ),
+    'food': (
+        ('packaging_intact', int, True),
+        ('expiry_status', str, True),
+        ('weight_or_volume_matches_label', int, True),
+        ('visible_spoilage_present', int, True),
+        ('abnormal_smell_or_appearance', int, True),
+        ('evidence_photos', str, False),
+    ),
+    'apparel': (
+        ('material_quality', str, True),
+        ('stitching_quality', str, True),
+        ('fit_consistency', str, True),
+        ('early_wear_present', int, True),
+        ('color_or_print_fading', int, True),
+        ('evidence_photos', str, False),
+    ),
+}
+
+CATEGORY_COLUMNS = {
+    category: tuple(name for name, _, _ in fields) for category, fields in QUALITY_FIELDS.items()
+}
+
+SCORERS = {
+    'electronics': score_electronics,
+    'pharma': score_pharma,
+    'food': score_food,
+    'apparel': score_apparel,
+}
+
+
+def parse_quality_data(category, fields):
+    """
+    Validate a category's quality fields from a form or JSON mapping.
+
+    Returns the typed detail row; raises ValueError with a user-facing
+    message on missing or malformed fields.
+    """
+    spec = QUALITY_FIELDS[category]
+    if any(required and fields.get(name) in (None, '') for name, _, required in spec):
+        raise ValueError("All required fields must be filled")
+
+    data = {}
+    try:
+        for name, kind, _ in spec:
+            value = fields.get(name)
+            if kind is int:
+                data[name] = None if value in (None, '') else int(value)
+            else:
+                data[name] = '' if value is None else str(value)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid input data")
+    return data
+
+
+def ensure_quality_report_scores(db):
+    """
+    Add the denormalized score columns to quality_reports if they are missing.
+
+    Each quality report carries the normalized_quality_score and
+    scoring_version of its category row, so readers need a single join on
+    quality_reports instead of one LEFT JOIN per category table. Existing
+    reports are backfilled when the columns are first added.
+    """
+    columns = {row['name'] for row in db.execute("SELECT name FROM pragma_table_info('quality_reports')")}
+    if 'normalized_quality_score' in columns and 'scoring_version' in columns:
+        return
+
+    if 'normalized_quality_score' not in columns:
+        db.execute(
+            "ALTER TABLE quality_reports ADD COLUMN normalized_quality_score REAL "
+            "CHECK (normalized_quality_score BETWEEN 0.0 AND 1.0)"
+        )
+    if 'scoring_version' not in columns:
+        db.execute("ALTER TABLE quality_reports ADD COLUMN scoring_version TEXT")
+
+    for category in ('electronics', 'pharma', 'food', 'apparel'):
+        db.execute(
+            "UPDATE quality_reports SET "
+            "normalized_quality_score = c.normalized_quality_score, scoring_version = c.scoring_version "
+            f"FROM {category}_quality_reports c WHERE c.quality_report_id = quality_reports.id"
+        )
+
+
+def ensure_quality_report_updated_at(db):
+    """Add quality_reports.updated_at, set whenever a report is edited"""
+    columns = {row['name'] for row in db.execute("SELECT name FROM pragma_table_info('quality_reports')")}
+    if 'updated_at' not in columns:
+        db.execute("ALTER TABLE quality_reports ADD COLUMN updated_at DATETIME")
+
+
+def ensure_quality_report_details(db):
+    """
+    Replace the four {category}_quality_reports tables with one
+    quality_report_details table.
+
+    Each quality report has one detail row, keyed by the report id, with
+    the columns of every category (other categories' columns stay NULL)
+    and the value checks of the old tables. The (quality_report_id,
+    category) foreign key ties the row to its report's category, which
+    replaces the enforce_single_category_* insert triggers. Existing
+    detail rows are copied over and the old tables dropped.
+    """
+    db.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_quality_reports_id_category ON quality_reports (id, category)"
+    )
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS quality_report_details ("
+        "quality_report_id INTEGER PRIMARY KEY, "
+        "category TEXT NOT NULL, "
+        # electronics
+        "device_functional INTEGER CHECK (device_functional IN (0, 1)), "
+        "authenticity_confidence INTEGER CHECK (authenticity_confidence BETWEEN 1 AND 5), "
+        "condition_match INTEGER CHECK (condition_match BETWEEN 1 AND 5), "
+        "warranty_honored INTEGER CHECK (warranty_honored IN (0, 1)), "
+        "accessories_complete INTEGER CHECK (accessories_complete IN (0, 1)), "
+        "reported_issue TEXT, "
+        # pharma
+        "packaging_sealed INTEGER CHECK (packaging_sealed IN (0, 1)), "
+        "expiry_date_present INTEGER CHECK (expiry_date_present IN (0, 1)), "
+        "label_completeness TEXT CHECK (label_completeness IN ('complete', 'partial', 'missing')), "
+        "dosage_label_matches_expected INTEGER CHECK (dosage_label_matches_expected IN (0, 1)), "
+        "physical_anomalies_present INTEGER CHECK (physical_anomalies_present IN (0, 1)), "
+        # pharma and food
+        "expiry_status TEXT CHECK (expiry_status IN ('valid', 'near_expiry', 'expired', 'missing')), "
+        # food
+        "packaging_intact INTEGER CHECK (packaging_intact IN (0, 1)), "
+        "weight_or_volume_matches_label INTEGER CHECK (weight_or_volume_matches_label IN (0, 1)), "
+        "visible_spoilage_present INTEGER CHECK (visible_spoilage_present IN (0, 1)), "
+        "abnormal_smell_or_appearance INTEGER CHECK (abnormal_smell_or_appearance IN (0, 1)), "
+        # apparel
+        "material_quality TEXT CHECK (material_quality IN ('as_expected', 'below_expected', 'poor')), "
+        "stitching_quality TEXT CHECK (stitching_quality IN ('intact', 'minor_defects', 'major_defects')), "
+        "fit_consistency TEXT CHECK (fit_consistency IN ('as_expected', 'tight', 'loose', 'inconsistent')), "
+        "early_wear_present INTEGER CHECK (early_wear_present IN (0, 1)), "
+        "color_or_print_fading INTEGER CHECK (color_or_print_fading IN (0, 1)), "
+        # all but electronics
+        "evidence_photos TEXT, "
+        "CHECK (category <> 'electronics' OR (device_functional IS NOT NULL "
+        "AND authenticity_confidence IS NOT NULL AND condition_match IS NOT NULL "
+        "AND accessories_complete IS NOT NULL)), "
+        "CHECK (category <> 'pharma' OR (packaging_sealed IS NOT NULL AND expiry_date_present IS NOT NULL "
+        "AND expiry_status IS NOT NULL AND expiry_status <> 'missing' AND label_completeness IS NOT NULL "
+        "AND dosage_label_matches_expected IS NOT NULL AND physical_anomalies_present IS NOT NULL)), "
+        "CHECK (category <> 'food' OR (packaging_intact IS NOT NULL AND expiry_status IS NOT NULL "
+        "AND weight_or_volume_matches_label IS NOT NULL AND visible_spoilage_present IS NOT NULL "
+        "AND abnormal_smell_or_appearance IS NOT NULL)), "
+        "CHECK (category <> 'apparel' OR (material_quality IS NOT NULL AND stitching_quality IS NOT NULL "
+        "AND fit_consistency IS NOT NULL AND early_wear_present IS NOT NULL "
+        "AND color_or_print_fading IS NOT NULL)), "
+        "FOREIGN KEY (quality_report_id, category) REFERENCES quality_reports(id, category) ON DELETE CASCADE"
+        ")"
+    )
+
+    tables = {row['name'] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for category, columns in CATEGORY_COLUMNS.items():
+        if f"{category}_quality_reports" not in tables:
+            continue
+        db.execute(
+            f"INSERT OR IGNORE INTO quality_report_details (quality_report_id, category, {', '.join(columns)}) "
+            f"SELECT quality_report_id, ?, {', '.join(columns)} FROM {category}_quality_reports",
+            category
+        )
+        db.execute(f"DROP TRIGGER IF EXISTS enforce_single_category_{category}")
+        db.execute(f"DROP TABLE {category}_quality_reports")
+
+
+def load_quality_report(db, price_report_id):
+    """
+    The quality report of a price report merged with its detail fields,
+    or None if it has none.
+    """
+    rows = db.execute(
+        "SELECT d.*, qr.* FROM quality_reports qr "
+        "LEFT JOIN quality_report_details d ON d.quality_report_id = qr.id "
+        "WHERE qr.price_report_id = ?",
+        price_report_id
+    )
+    return rows[0] if rows else None
+
+
+def write_quality_report(db, price_report_id, user_id, category, data, score, scoring_version=SCORING_VERSION):
+    """
+    Insert or update the quality report for a price report.
+
+    Writes the quality_reports row, its detail row (from data, keyed by
+    CATEGORY_COLUMNS) and the shop price summary. Call inside a
+    transaction. Returns (quality_report_id, updated), where updated is
+    True if an existing report was changed.
+    """
+    columns = CATEGORY_COLUMNS[category]
+    values = [data[column] for column in columns]
+
+    existing = db.execute(
+        "SELECT id, normalized_quality_score FROM quality_reports WHERE price_report_id = ?",
+        price_report_id
+    )
+    if existing:
+        quality_report_id = existing[0]['id']
+        db.execute(
+            "UPDATE quality_report_details SET "
+            + ", ".join(f"{column} = ?" for column in columns)
+            + " WHERE quality_report_id = ?",
+            *values,
+            quality_report_id
+        )
+        db.execute(
+            "UPDATE quality_reports SET normalized_quality_score = ?, scoring_version = ?, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            score,
+            scoring_version,
+            quality_report_id
+        )
+        record_quality_score(db, price_report_id, score, existing[0]['normalized_quality_score'])
+        return quality_report_id, True
+
+    quality_report_id = db.execute(
+        "INSERT INTO quality_reports (price_report_id, user_id, category, normalized_quality_score, scoring_version) "
+        "VALUES (?, ?, ?, ?, ?)",
+        price_report_id,
+        user_id,
+        category,
+        score,
+        scoring_version
+    )
+    db.execute(
+        f"INSERT INTO quality_report_details (quality_report_id, category, {', '.join(columns)}) "
+        f"VALUES (?, ?, {', '.join('?' * len(columns))})",
+        quality_report_id,
+        category,
+        *values
+    )
+    record_quality_score(db, price_report_id, score)
+    return quality_report_id, False
+
+
+def save_quality_report(db, price_report_id, user_id, category, data, score, scoring_version=SCORING_VERSION):
+    """
+    write_quality_report in its own transaction, so a failure leaves the
+    report, its detail row and the summary unchanged. Returns True if an
+    existing report was updated, False if a new one was created.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        _, updated = write_quality_report(db, price_report_id, user_id, category, data, score, scoring_version)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return updated
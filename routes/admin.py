@@ -1,38 +1,43 @@
+from functools import wraps
 from flask import Blueprint, redirect, render_template, request, session
 from helpers import apology, login_required, is_admin
-from cs50 import SQL
+from search_cache import search_cache
+from tiles import tile_cache
+from write_queue import current_price_report_writer
+from db import db, pool_stats
 
 # Create blueprint
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
-# Database connection
-db = SQL("sqlite:///app.db")
+
+def admin_required(f):
+    """Decorate routes to require an admin user; use below login_required"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            row = db.execute("SELECT user_type FROM users WHERE id = ?", session.get("user_id"))
+        except Exception:
+            return apology("Database error", 500)
+        if len(row) != 1 or not is_admin(row[0]):
+            return apology("Access denied", 403)
+        return f(*args, **kwargs)
+
+    return decorated_function
 
 
 @admin_bp.route("/review/shops")
 @login_required
+@admin_required
 def review_shops():
-    try:
-        row = db.execute("SELECT user_type FROM users WHERE id = ?", session.get("user_id"))
-    except Exception:
-        return apology("Database error", 500)
-    if len(row) != 1 or not is_admin(row[0]):
-        return apology("Access denied", 403)
-    
     proposals = db.execute("SELECT * FROM shop_proposals WHERE status = 'pending'")
     return render_template("review_shops.html", proposals=proposals)
 
 
 @admin_bp.route("/review/shops/approve", methods=["POST"])
 @login_required
+@admin_required
 def review_shops_approve():
-    try:
-        row = db.execute("SELECT user_type FROM users WHERE id = ?", session.get("user_id"))
-    except Exception:
-        return apology("Database error", 500)
-    if len(row) != 1 or not is_admin(row[0]):
-        return apology("Access denied", 403)
-
     proposal_id = request.form.get("id")
     if not proposal_id:
         return apology("Missing proposal id", 400)
@@ -64,19 +69,16 @@ def review_shops_approve():
     except Exception:
         return apology("Failed to approve proposal", 500)
 
+    # A new shop changes what nearby searches around it can return
+    search_cache.invalidate(lat=prop['latitude'], lon=prop['longitude'])
+
     return redirect("/admin/review/shops")
 
 
 @admin_bp.route("/review/shops/reject", methods=["POST"])
 @login_required
+@admin_required
 def review_shops_reject():
-    try:
-        row = db.execute("SELECT user_type FROM users WHERE id = ?", session.get("user_id"))
-    except Exception:
-        return apology("Database error", 500)
-    if len(row) != 1 or not is_admin(row[0]):
-        return apology("Access denied", 403)
-
     proposal_id = request.form.get("id")
     if not proposal_id:
         return apology("Missing proposal id", 400)
@@ -95,14 +97,8 @@ def review_shops_reject():
 
 @admin_bp.route("/review/product_aliases")
 @login_required
+@admin_required
 def review_product_aliases():
-    try:
-        row = db.execute("SELECT user_type FROM users WHERE id = ?", session.get("user_id"))
-    except Exception:
-        return apology("Database error", 500)
-    if len(row) != 1 or not is_admin(row[0]):
-        return apology("Access denied", 403)
-
     # join product details for display
     try:
         proposals = db.execute(
@@ -118,14 +114,8 @@ def review_product_aliases():
 
 @admin_bp.route("/review/product_aliases/approve", methods=["POST"])
 @login_required
+@admin_required
 def review_product_aliases_approve():
-    try:
-        row = db.execute("SELECT user_type FROM users WHERE id = ?", session.get("user_id"))
-    except Exception:
-        return apology("Database error", 500)
-    if len(row) != 1 or not is_admin(row[0]):
-        return apology("Access denied", 403)
-
     proposal_id = request.form.get("id")
     if not proposal_id:
         return apology("Missing proposal id", 400)
@@ -159,14 +149,8 @@ def review_product_aliases_approve():
 
 @admin_bp.route("/review/product_aliases/reject", methods=["POST"])
 @login_required
+@admin_required
 def review_product_aliases_reject():
-    try:
-        row = db.execute("SELECT user_type FROM users WHERE id = ?", session.get("user_id"))
-    except Exception:
-        return apology("Database error", 500)
-    if len(row) != 1 or not is_admin(row[0]):
-        return apology("Access denied", 403)
-
     proposal_id = request.form.get("id")
     if not proposal_id:
         return apology("Missing proposal id", 400)
@@ -181,3 +165,31 @@ def review_product_aliases_reject():
         return apology("Failed to reject proposal", 500)
 
     return redirect("/admin/review/product_aliases")
+
+
+@admin_bp.route("/stats/search_cache")
+@login_required
+@admin_required
+def search_cache_stats():
+    return search_cache.stats()
+
+
+@admin_bp.route("/stats/tile_cache")
+@login_required
+@admin_required
+def tile_cache_stats():
+    return tile_cache.stats()
+
+
+@admin_bp.route("/stats/db")
+@login_required
+@admin_required
+def db_stats():
+    return pool_stats()
+
+
+@admin_bp.route("/stats/write_queue")
+@login_required
+@admin_required
+def write_queue_stats():
+    return current_price_report_writer().stats()
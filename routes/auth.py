@@ -1,14 +1,11 @@
 from flask import Blueprint, redirect, render_template, request, session
 from werkzeug.security import check_password_hash, generate_password_hash
 from helpers import apology, is_valid_email
-from cs50 import SQL
+from db import db
 
 # Create blueprint
 auth_bp = Blueprint('auth', __name__)
 
-# Database connection
-db = SQL("sqlite:///app.db")
-
 
 @auth_bp.route("/login", methods=["GET", "POST"])
 def login():
@@ -1,13 +1,26 @@
-from flask import Blueprint, flash, redirect, render_template, request, session
-from helpers import apology, login_required, score_electronics, score_pharma, score_food, score_apparel
-from cs50 import SQL
+import math
+import queue
+from datetime import timedelta
+from flask import Blueprint, current_app, flash, redirect, render_template, request, session, stream_with_context
+from helpers import apology, login_required, encode_search_cursor, decode_search_cursor, parse_price_report
+from aggregates import area_stats, summary_stats
+from sketch import dump_sketch, sketch_add, sketch_quantiles
+from quality import QUALITY_FIELDS, SCORERS, load_quality_report, parse_quality_data, save_quality_report
+from archive import ALL_PRICE_REPORTS, price_reports_source
+from basket import MAX_BASKET_ITEMS, MAX_BASKET_SHOPS, plan_basket
+from outliers import SUSPECT_REPORT_IDS
+from submissions import MAX_BATCH_ITEMS, save_price_report, submit_price_report_batch
+from export import EXPORT_FORMATS, iter_price_reports, parse_export_filters
+from search_cache import quantize_location, search_cache
+from tiles import MAX_TILE_ZOOM, cached_price_tile, tile_cache, tiles_for_bbox
+from trends import TREND_INTERVALS, price_trend
+from write_queue import current_price_report_writer
+from geo import bounding_box
+from db import db
 
 # Create blueprint
 user_bp = Blueprint('user', __name__)
 
-# Database connection
-db = SQL("sqlite:///app.db")
-
 
 @user_bp.route("/create/shop", methods=["GET", "POST"])
 @login_required
@@ -30,6 +43,8 @@ def create_shop():
             longitude = float(lon)
         except (ValueError, TypeError):
             return apology("Invalid latitude/longitude", 400)
+        if not math.isfinite(latitude) or not math.isfinite(longitude):
+            return apology("Invalid latitude/longitude", 400)
 
         try:
             db.execute(
@@ -92,40 +107,27 @@ def create_product_alias():
 @login_required
 def create_price_report():
     if request.method == "POST":
-        shop_id_str = request.form.get('shop_id')
-        product_alias_id_str = request.form.get('product_alias_id')
-        price_paid_str = request.form.get('price_paid')
-        quantity_str = request.form.get('quantity', '1')
-
-        if not shop_id_str:
-            return apology("Must select a shop", 400)
-        if not product_alias_id_str:
-            return apology("Must select a product", 400)
-        if not price_paid_str:
-            return apology("Must provide price paid", 400)
-
         try:
-            shop_id = int(shop_id_str)
-            product_alias_id = int(product_alias_id_str)
-            price_paid = float(price_paid_str)
-            quantity = int(quantity_str)
-        except (ValueError, TypeError):
-            return apology("Invalid input data", 400)
-
-        if price_paid <= 0:
-            return apology("Price must be positive", 400)
-        if quantity <= 0:
-            return apology("Quantity must be positive", 400)
+            report = parse_price_report(
+                request.form.get('shop_id'),
+                request.form.get('product_alias_id'),
+                request.form.get('price_paid'),
+                request.form.get('quantity', '1')
+            )
+        except ValueError as e:
+            return apology(str(e), 400)
 
         try:
-            db.execute(
-                "INSERT INTO price_reports (user_id, shop_id, product_alias_id, price_paid, quantity) VALUES (?, ?, ?, ?, ?)",
-                session.get("user_id"),
-                shop_id,
-                product_alias_id,
-                price_paid,
-                quantity,
-            )
+            if current_app.config.get("WRITE_BEHIND"):
+                price_report_id = current_price_report_writer().submit(session.get("user_id"), report)
+            else:
+                price_report_id = save_price_report(db, session.get("user_id"), report)
+            invalidate_cached_searches(price_report_id)
+        except queue.Full:
+            return apology("Too many submissions right now, please try again", 503)
+        except TimeoutError:
+            # Still queued, so submitting again could save it twice
+            return apology("Report still being saved, check your reports before resubmitting", 202)
         except Exception:
             return apology("Failed to create price report (database error)", 500)
 
@@ -152,8 +154,9 @@ def user_price_reports():
     try:
         price_reports = db.execute(
             "SELECT pr.id, s.name AS shop_name, pa.alias_name, p.canonical_name, p.category, pr.price_paid, pr.quantity, "
-            "qr.id AS quality_report_id "
-            "FROM price_reports pr "
+            "qr.id AS quality_report_id, "
+            "EXISTS (SELECT 1 FROM price_reports_archive a WHERE a.id = pr.id) AS archived "
+            f"FROM {ALL_PRICE_REPORTS} pr "
             "JOIN shops s ON pr.shop_id = s.id "
             "JOIN product_aliases pa ON pr.product_alias_id = pa.id "
             "JOIN products p ON pa.product_id = p.id "
@@ -205,23 +208,15 @@ def create_quality_report(price_report_id):
     is_update = len(existing_qr) > 0
 
     if request.method == "POST":
-        # Process form based on category
-        if category == 'electronics':
-            return process_electronics_quality(price_report_id, category, is_update)
-        elif category == 'pharma':
-            return process_pharma_quality(price_report_id, category, is_update)
-        elif category == 'food':
-            return process_food_quality(price_report_id, category, is_update)
-        elif category == 'apparel':
-            return process_apparel_quality(price_report_id, category, is_update)
-        else:
+        if category not in QUALITY_FIELDS:
             return apology("Invalid category", 400)
+        return process_quality_report(price_report_id, category)
     
     else:
         # Load existing data if updating
         existing_data = None
         if is_update:
-            existing_data = get_existing_quality_data(price_report_id, category)
+            existing_data = get_existing_quality_data(price_report_id)
         
         return render_template("create_quality_report.html", 
                              price_report_id=price_report_id, 
@@ -230,432 +225,66 @@ def create_quality_report(price_report_id):
                              existing_data=existing_data)
 
 
-def get_existing_quality_data(price_report_id, category):
-    """Fetch existing quality report data based on category"""
+def invalidate_cached_searches(*price_report_ids):
+    """Drop cached searches whose results include any of the given price reports"""
     try:
-        qr = db.execute(
-            "SELECT * FROM quality_reports WHERE price_report_id = ?",
-            price_report_id
+        rows = db.execute(
+            "SELECT DISTINCT pr.product_alias_id, pa.product_id, s.latitude, s.longitude "
+            "FROM price_reports pr "
+            "JOIN shops s ON pr.shop_id = s.id "
+            "JOIN product_aliases pa ON pr.product_alias_id = pa.id "
+            "WHERE pr.id IN (?)",
+            list(price_report_ids)
         )
-        if not qr:
-            return None
-        
-        quality_report_id = qr[0]['id']
-        
-        if category == 'electronics':
-            data = db.execute(
-                "SELECT * FROM electronics_quality_reports WHERE quality_report_id = ?",
-                quality_report_id
-            )
-        elif category == 'pharma':
-            data = db.execute(
-                "SELECT * FROM pharma_quality_reports WHERE quality_report_id = ?",
-                quality_report_id
-            )
-        elif category == 'food':
-            data = db.execute(
-                "SELECT * FROM food_quality_reports WHERE quality_report_id = ?",
-                quality_report_id
-            )
-        elif category == 'apparel':
-            data = db.execute(
-                "SELECT * FROM apparel_quality_reports WHERE quality_report_id = ?",
-                quality_report_id
-            )
-        else:
-            return None
-        
-        if data:
-            return {**qr[0], **data[0]}
-        return qr[0]
     except Exception as e:
-        print(f"Error fetching existing quality data: {e}")
-        return None
-
-
-def process_electronics_quality(price_report_id, category, is_update=False):
-    """Process electronics quality report"""
-    device_functional = request.form.get('device_functional')
-    authenticity_confidence = request.form.get('authenticity_confidence')
-    condition_match = request.form.get('condition_match')
-    warranty_honored = request.form.get('warranty_honored')
-    accessories_complete = request.form.get('accessories_complete')
-    reported_issue = request.form.get('reported_issue', '')
-
-    if not all([device_functional, authenticity_confidence, condition_match, accessories_complete]):
-        return apology("All required fields must be filled", 400)
-
-    try:
-        data = {
-            'device_functional': int(device_functional),
-            'authenticity_confidence': int(authenticity_confidence),
-            'condition_match': int(condition_match),
-            'warranty_honored': int(warranty_honored) if warranty_honored else None,
-            'accessories_complete': int(accessories_complete),
-            'reported_issue': reported_issue
-        }
-    except (ValueError, TypeError):
-        return apology("Invalid input data", 400)
-
-    # Calculate quality score
-    quality_score = score_electronics(data)
-
-    try:
-        if is_update:
-            # Get existing quality report id
-            qr = db.execute(
-                "SELECT id FROM quality_reports WHERE price_report_id = ?",
-                price_report_id
-            )
-            quality_report_id = qr[0]['id']
-            
-            # Update electronics_quality_reports
-            db.execute(
-                "UPDATE electronics_quality_reports SET "
-                "device_functional = ?, authenticity_confidence = ?, condition_match = ?, "
-                "warranty_honored = ?, accessories_complete = ?, reported_issue = ?, "
-                "normalized_quality_score = ? "
-                "WHERE quality_report_id = ?",
-                data['device_functional'],
-                data['authenticity_confidence'],
-                data['condition_match'],
-                data['warranty_honored'],
-                data['accessories_complete'],
-                data['reported_issue'],
-                quality_score,
-                quality_report_id
-            )
-            
-            # Update timestamp in quality_reports
-            db.execute(
-                "UPDATE quality_reports SET updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                quality_report_id
-            )
-            
-            flash("Quality report updated successfully!")
-        else:
-            # Insert into quality_reports
-            db.execute(
-                "INSERT INTO quality_reports (price_report_id, user_id, category) VALUES (?, ?, ?)",
-                price_report_id,
-                session.get("user_id"),
-                category
-            )
-            
-            quality_report_id = db.execute("SELECT last_insert_rowid() AS id")[0]['id']
-
-            # Insert into electronics_quality_reports
-            db.execute(
-                "INSERT INTO electronics_quality_reports "
-                "(quality_report_id, device_functional, authenticity_confidence, condition_match, "
-                "warranty_honored, accessories_complete, reported_issue, normalized_quality_score, scoring_version) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                quality_report_id,
-                data['device_functional'],
-                data['authenticity_confidence'],
-                data['condition_match'],
-                data['warranty_honored'],
-                data['accessories_complete'],
-                data['reported_issue'],
-                quality_score,
-                "v1.0"
-            )
-
-            flash("Quality report submitted successfully!")
-        
-        return redirect("/user/price_reports")
-    except Exception as e:
-        print(f"Database error: {e}")
-        return apology("Failed to create quality report", 500)
-
-
-def process_pharma_quality(price_report_id, category, is_update=False):
-    """Process pharmaceutical quality report"""
-    packaging_sealed = request.form.get('packaging_sealed')
-    expiry_date_present = request.form.get('expiry_date_present')
-    expiry_status = request.form.get('expiry_status')
-    label_completeness = request.form.get('label_completeness')
-    dosage_label_matches_expected = request.form.get('dosage_label_matches_expected')
-    physical_anomalies_present = request.form.get('physical_anomalies_present')
-    evidence_photos = request.form.get('evidence_photos', '')
-
-    if not all([packaging_sealed, expiry_date_present, expiry_status, label_completeness, 
-                dosage_label_matches_expected, physical_anomalies_present]):
-        return apology("All required fields must be filled", 400)
-
-    try:
-        data = {
-            'packaging_sealed': int(packaging_sealed),
-            'expiry_date_present': int(expiry_date_present),
-            'expiry_status': expiry_status,
-            'label_completeness': label_completeness,
-            'dosage_label_matches_expected': int(dosage_label_matches_expected),
-            'physical_anomalies_present': int(physical_anomalies_present),
-            'evidence_photos': evidence_photos
-        }
-    except (ValueError, TypeError):
-        return apology("Invalid input data", 400)
+        print(f"Database error invalidating search cache: {e}")
+        search_cache.clear()
+        tile_cache.clear()
+        return
+    
+    # One invalidation per distinct (alias, shop), however many reports it got
+    for row in rows:
+        search_cache.invalidate(
+            lat=row['latitude'],
+            lon=row['longitude'],
+            product_alias_id=row['product_alias_id'],
+            product_id=row['product_id']
+        )
+        tile_cache.invalidate(
+            lat=row['latitude'],
+            lon=row['longitude'],
+            product_alias_id=row['product_alias_id']
+        )
 
-    quality_score = score_pharma(data)
 
+def get_existing_quality_data(price_report_id):
+    """Fetch the existing quality report with its detail fields"""
     try:
-        if is_update:
-            # Get existing quality report id
-            qr = db.execute(
-                "SELECT id FROM quality_reports WHERE price_report_id = ?",
-                price_report_id
-            )
-            quality_report_id = qr[0]['id']
-            
-            # Update pharma_quality_reports
-            db.execute(
-                "UPDATE pharma_quality_reports SET "
-                "packaging_sealed = ?, expiry_date_present = ?, expiry_status = ?, "
-                "label_completeness = ?, dosage_label_matches_expected = ?, "
-                "physical_anomalies_present = ?, evidence_photos = ?, normalized_quality_score = ? "
-                "WHERE quality_report_id = ?",
-                data['packaging_sealed'],
-                data['expiry_date_present'],
-                data['expiry_status'],
-                data['label_completeness'],
-                data['dosage_label_matches_expected'],
-                data['physical_anomalies_present'],
-                data['evidence_photos'],
-                quality_score,
-                quality_report_id
-            )
-            
-            # Update timestamp in quality_reports
-            db.execute(
-                "UPDATE quality_reports SET updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                quality_report_id
-            )
-            
-            flash("Quality report updated successfully!")
-        else:
-            db.execute(
-                "INSERT INTO quality_reports (price_report_id, user_id, category) VALUES (?, ?, ?)",
-                price_report_id,
-                session.get("user_id"),
-                category
-            )
-            
-            quality_report_id = db.execute("SELECT last_insert_rowid() AS id")[0]['id']
-
-            db.execute(
-                "INSERT INTO pharma_quality_reports "
-                "(quality_report_id, packaging_sealed, expiry_date_present, expiry_status, "
-                "label_completeness, dosage_label_matches_expected, physical_anomalies_present, "
-                "evidence_photos, normalized_quality_score, scoring_version) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                quality_report_id,
-                data['packaging_sealed'],
-                data['expiry_date_present'],
-                data['expiry_status'],
-                data['label_completeness'],
-                data['dosage_label_matches_expected'],
-                data['physical_anomalies_present'],
-                data['evidence_photos'],
-                quality_score,
-                "v1.0"
-            )
-
-            flash("Quality report submitted successfully!")
-        
-        return redirect("/user/price_reports")
+        return load_quality_report(db, price_report_id)
     except Exception as e:
-        print(f"Database error: {e}")
-        return apology("Failed to create quality report", 500)
-
-
-def process_food_quality(price_report_id, category, is_update=False):
-    """Process food quality report"""
-    packaging_intact = request.form.get('packaging_intact')
-    expiry_status = request.form.get('expiry_status')
-    weight_or_volume_matches_label = request.form.get('weight_or_volume_matches_label')
-    visible_spoilage_present = request.form.get('visible_spoilage_present')
-    abnormal_smell_or_appearance = request.form.get('abnormal_smell_or_appearance')
-    evidence_photos = request.form.get('evidence_photos', '')
+        print(f"Error fetching existing quality data: {e}")
+        return None
 
-    if not all([packaging_intact, expiry_status, weight_or_volume_matches_label,
-                visible_spoilage_present, abnormal_smell_or_appearance]):
-        return apology("All required fields must be filled", 400)
 
+def process_quality_report(price_report_id, category):
+    """Validate, score and save a quality report form for the given category"""
     try:
-        data = {
-            'packaging_intact': int(packaging_intact),
-            'expiry_status': expiry_status,
-            'weight_or_volume_matches_label': int(weight_or_volume_matches_label),
-            'visible_spoilage_present': int(visible_spoilage_present),
-            'abnormal_smell_or_appearance': int(abnormal_smell_or_appearance),
-            'evidence_photos': evidence_photos
-        }
-    except (ValueError, TypeError):
-        return apology("Invalid input data", 400)
+        data = parse_quality_data(category, request.form)
+    except ValueError as e:
+        return apology(str(e), 400)
 
-    quality_score = score_food(data)
+    quality_score = SCORERS[category](data)
 
     try:
-        if is_update:
-            # Get existing quality report id
-            qr = db.execute(
-                "SELECT id FROM quality_reports WHERE price_report_id = ?",
-                price_report_id
-            )
-            quality_report_id = qr[0]['id']
-            
-            # Update food_quality_reports
-            db.execute(
-                "UPDATE food_quality_reports SET "
-                "packaging_intact = ?, expiry_status = ?, weight_or_volume_matches_label = ?, "
-                "visible_spoilage_present = ?, abnormal_smell_or_appearance = ?, "
-                "evidence_photos = ?, normalized_quality_score = ? "
-                "WHERE quality_report_id = ?",
-                data['packaging_intact'],
-                data['expiry_status'],
-                data['weight_or_volume_matches_label'],
-                data['visible_spoilage_present'],
-                data['abnormal_smell_or_appearance'],
-                data['evidence_photos'],
-                quality_score,
-                quality_report_id
-            )
-            
-            # Update timestamp in quality_reports
-            db.execute(
-                "UPDATE quality_reports SET updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                quality_report_id
-            )
-            
-            flash("Quality report updated successfully!")
-        else:
-            db.execute(
-                "INSERT INTO quality_reports (price_report_id, user_id, category) VALUES (?, ?, ?)",
-                price_report_id,
-                session.get("user_id"),
-                category
-            )
-            
-            quality_report_id = db.execute("SELECT last_insert_rowid() AS id")[0]['id']
-
-            db.execute(
-                "INSERT INTO food_quality_reports "
-                "(quality_report_id, packaging_intact, expiry_status, weight_or_volume_matches_label, "
-                "visible_spoilage_present, abnormal_smell_or_appearance, evidence_photos, "
-                "normalized_quality_score, scoring_version) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                quality_report_id,
-                data['packaging_intact'],
-                data['expiry_status'],
-                data['weight_or_volume_matches_label'],
-                data['visible_spoilage_present'],
-                data['abnormal_smell_or_appearance'],
-                data['evidence_photos'],
-                quality_score,
-                "v1.0"
-            )
-
-            flash("Quality report submitted successfully!")
-        
-        return redirect("/user/price_reports")
+        updated = save_quality_report(db, price_report_id, session.get("user_id"), category, data, quality_score)
     except Exception as e:
         print(f"Database error: {e}")
         return apology("Failed to create quality report", 500)
 
-
-def process_apparel_quality(price_report_id, category, is_update=False):
-    """Process apparel quality report"""
-    material_quality = request.form.get('material_quality')
-    stitching_quality = request.form.get('stitching_quality')
-    fit_consistency = request.form.get('fit_consistency')
-    early_wear_present = request.form.get('early_wear_present')
-    color_or_print_fading = request.form.get('color_or_print_fading')
-    evidence_photos = request.form.get('evidence_photos', '')
-
-    if not all([material_quality, stitching_quality, fit_consistency,
-                early_wear_present, color_or_print_fading]):
-        return apology("All required fields must be filled", 400)
-
-    try:
-        data = {
-            'material_quality': material_quality,
-            'stitching_quality': stitching_quality,
-            'fit_consistency': fit_consistency,
-            'early_wear_present': int(early_wear_present),
-            'color_or_print_fading': int(color_or_print_fading),
-            'evidence_photos': evidence_photos
-        }
-    except (ValueError, TypeError):
-        return apology("Invalid input data", 400)
-
-    quality_score = score_apparel(data)
-
-    try:
-        if is_update:
-            # Get existing quality report id
-            qr = db.execute(
-                "SELECT id FROM quality_reports WHERE price_report_id = ?",
-                price_report_id
-            )
-            quality_report_id = qr[0]['id']
-            
-            # Update apparel_quality_reports
-            db.execute(
-                "UPDATE apparel_quality_reports SET "
-                "material_quality = ?, stitching_quality = ?, fit_consistency = ?, "
-                "early_wear_present = ?, color_or_print_fading = ?, "
-                "evidence_photos = ?, normalized_quality_score = ? "
-                "WHERE quality_report_id = ?",
-                data['material_quality'],
-                data['stitching_quality'],
-                data['fit_consistency'],
-                data['early_wear_present'],
-                data['color_or_print_fading'],
-                data['evidence_photos'],
-                quality_score,
-                quality_report_id
-            )
-            
-            # Update timestamp in quality_reports
-            db.execute(
-                "UPDATE quality_reports SET updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                quality_report_id
-            )
-            
-            flash("Quality report updated successfully!")
-        else:
-            db.execute(
-                "INSERT INTO quality_reports (price_report_id, user_id, category) VALUES (?, ?, ?)",
-                price_report_id,
-                session.get("user_id"),
-                category
-            )
-            
-            quality_report_id = db.execute("SELECT last_insert_rowid() AS id")[0]['id']
-
-            db.execute(
-                "INSERT INTO apparel_quality_reports "
-                "(quality_report_id, material_quality, stitching_quality, fit_consistency, "
-                "early_wear_present, color_or_print_fading, evidence_photos, "
-                "normalized_quality_score, scoring_version) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                quality_report_id,
-                data['material_quality'],
-                data['stitching_quality'],
-                data['fit_consistency'],
-                data['early_wear_present'],
-                data['color_or_print_fading'],
-                data['evidence_photos'],
-                quality_score,
-                "v1.0"
-            )
-
-            flash("Quality report submitted successfully!")
-        
-        return redirect("/user/price_reports")
-    except Exception as e:
-        print(f"Database error: {e}")
-        return apology("Failed to create quality report", 500)
+    # Quality scores show up in search results
+    invalidate_cached_searches(price_report_id)
+    flash("Quality report updated successfully!" if updated else "Quality report submitted successfully!")
+    return redirect("/user/price_reports")
 
 
 @user_bp.route("/browse/price_reports", methods=["GET"])
@@ -699,126 +328,614 @@ def get_product_aliases_by_category(category):
         return {"error": "Failed to load product aliases"}, 500
 
 
+@user_bp.route("/api/price_trend", methods=["GET"])
+@login_required
+def get_price_trend():
+    """
+    Daily or weekly unit price statistics for a product alias
+
+    Takes `product_alias_id`, `interval` (day or week), `start_date` and
+    `end_date` (YYYY-MM-DD, default the last year), and optionally a
+    region (`min_lat`, `max_lat`, `min_lon`, `max_lon`) or a radius
+    (`latitude`, `longitude`, `distance` in km). Served from the daily
+    rollup, so it never scans price_reports; `exclude_suspect=true` takes
+    the suspect reports back out.
+    """
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if 'product_alias_id' not in filters:
+        return {"error": "Product alias is required"}, 400
+
+    interval = request.args.get('interval', 'day')
+    if interval not in TREND_INTERVALS:
+        return {"error": "Interval must be day or week"}, 400
+
+    radius = None
+    if request.args.get('latitude') or request.args.get('longitude'):
+        try:
+            radius = (
+                float(request.args['latitude']),
+                float(request.args['longitude']),
+                float(request.args.get('distance', 10)),
+            )
+        except (KeyError, ValueError):
+            return {"error": "Radius needs numeric latitude, longitude and distance"}, 400
+        if not all(math.isfinite(value) for value in radius):
+            return {"error": "Radius needs numeric latitude, longitude and distance"}, 400
+        if radius[2] <= 0 or radius[2] > 100:
+            return {"error": "Distance must be between 0 and 100 km"}, 400
+
+    try:
+        points = price_trend(
+            db,
+            filters['product_alias_id'],
+            interval,
+            filters.get('start_date'),
+            filters.get('end_date'),
+            filters.get('bbox'),
+            radius,
+            request.args.get('exclude_suspect', '').lower() in ('1', 'true')
+        )
+    except Exception as e:
+        print(f"Error in get_price_trend: {e}")
+        return {"error": "Failed to load price trend"}, 500
+
+    return {
+        "product_alias_id": filters['product_alias_id'],
+        "interval": interval,
+        "points": points,
+    }
+
+
+@user_bp.route("/api/price_tiles/<int:zoom>/<int:x>/<int:y>", methods=["GET"])
+@login_required
+def get_price_tile(zoom, x, y):
+    """
+    Price clusters for the browse map in Web Mercator tile z/x/y
+
+    Takes `product_alias_id`. Returns the occupied cells of a fixed grid
+    over the tile, each with its centre, bounds, report and shop counts
+    and median, min and max unit price, so the payload depends on the
+    zoom level rather than the number of reports. `exclude_suspect=true`
+    leaves suspect reports out of the cells.
+    """
+    try:
+        filters = parse_export_filters({'product_alias_id': request.args.get('product_alias_id')})
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if 'product_alias_id' not in filters:
+        return {"error": "Product alias is required"}, 400
+    if zoom > MAX_TILE_ZOOM or x >= 2 ** zoom or y >= 2 ** zoom:
+        return {"error": "Invalid tile"}, 400
+
+    exclude_suspect = request.args.get('exclude_suspect', '').lower() in ('1', 'true')
+    try:
+        cells = cached_price_tile(db, filters['product_alias_id'], zoom, x, y, exclude_suspect)
+    except Exception as e:
+        print(f"Error in get_price_tile: {e}")
+        return {"error": "Failed to load price tile"}, 500
+
+    body = f'{{"zoom":{zoom},"x":{x},"y":{y},"cells":{cells}}}'
+    return current_app.response_class(body, mimetype="application/json")
+
+
+@user_bp.route("/api/price_clusters", methods=["GET"])
+@login_required
+def get_price_clusters():
+    """
+    Price clusters for the browse map within a bounding box
+
+    Takes `product_alias_id`, `zoom` and `min_lat`, `max_lat`, `min_lon`,
+    `max_lon`, and optionally `exclude_suspect`; returns the cells of
+    every tile at that zoom covering the box, as /api/price_tiles would,
+    built from the same tile cache.
+    """
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    try:
+        zoom = int(request.args['zoom'])
+    except (KeyError, ValueError):
+        return {"error": "Zoom must be a whole number"}, 400
+    if 'product_alias_id' not in filters:
+        return {"error": "Product alias is required"}, 400
+    if 'bbox' not in filters:
+        return {"error": "Bounding box is required"}, 400
+    if zoom < 0 or zoom > MAX_TILE_ZOOM:
+        return {"error": f"Zoom must be between 0 and {MAX_TILE_ZOOM}"}, 400
+
+    try:
+        tiles = tiles_for_bbox(filters['bbox'], zoom)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    exclude_suspect = request.args.get('exclude_suspect', '').lower() in ('1', 'true')
+    try:
+        tile_cells = [
+            cached_price_tile(db, filters['product_alias_id'], zoom, x, y, exclude_suspect) for x, y in tiles
+        ]
+    except Exception as e:
+        print(f"Error in get_price_clusters: {e}")
+        return {"error": "Failed to load price clusters"}, 500
+
+    # Splice the cached arrays rather than decoding them
+    cells = ",".join(text[1:-1] for text in tile_cells if text != "[]")
+    body = f'{{"zoom":{zoom},"tiles":{len(tiles)},"cells":[{cells}]}}'
+    return current_app.response_class(body, mimetype="application/json")
+
+
+@user_bp.route("/api/basket/plan", methods=["POST"])
+@login_required
+def plan_basket_route():
+    """
+    API endpoint to find the cheapest nearby shops for a basket of products
+
+    The body has `items` ([{"product_alias_id": 1, "quantity": 2}, ...]),
+    `latitude`, `longitude`, `distance` (km, default 10), `max_shops`
+    (default 1) and optionally `max_age_days` to ignore older prices.
+    Returns the cheapest plan for each number of shops up to max_shops
+    that saves money over fewer shops, based on each shop's latest
+    reported unit prices. An empty list means no such set of shops has
+    every item.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return {"error": "JSON body is required"}, 400
+
+    raw_items = data.get('items')
+    if not isinstance(raw_items, list) or not raw_items:
+        return {"error": "items must be a non-empty list"}, 400
+
+    items = {}
+    try:
+        for item in raw_items:
+            product_alias_id = int(item['product_alias_id'])
+            quantity = int(item.get('quantity', 1))
+            if quantity <= 0:
+                return {"error": "Quantity must be positive"}, 400
+            items[product_alias_id] = items.get(product_alias_id, 0) + quantity
+        user_lat = float(data['latitude'])
+        user_lon = float(data['longitude'])
+        max_distance = float(data.get('distance', 10))
+        max_shops = int(data.get('max_shops', 1))
+        max_age_days = int(data['max_age_days']) if data.get('max_age_days') is not None else None
+    except (KeyError, ValueError, TypeError, AttributeError):
+        return {"error": "Invalid input data"}, 400
+    if not all(math.isfinite(value) for value in (user_lat, user_lon, max_distance)):
+        return {"error": "Invalid input data"}, 400
+
+    if len(items) > MAX_BASKET_ITEMS:
+        return {"error": f"At most {MAX_BASKET_ITEMS} products per basket"}, 400
+    if max_distance <= 0 or max_distance > 100:
+        return {"error": "Distance must be between 0 and 100 km"}, 400
+    if max_shops < 1 or max_shops > MAX_BASKET_SHOPS:
+        return {"error": f"max_shops must be between 1 and {MAX_BASKET_SHOPS}"}, 400
+    if max_age_days is not None and max_age_days < 1:
+        return {"error": "max_age_days must be positive"}, 400
+
+    try:
+        result = plan_basket(db, items, user_lat, user_lon, max_distance, max_shops, max_age_days)
+    except Exception as e:
+        print(f"Error in plan_basket: {e}")
+        return {"error": "Failed to plan basket"}, 500
+
+    return {"success": True, **result}
+
+
+@user_bp.route("/api/price_reports/batch", methods=["POST"])
+@login_required
+def submit_price_reports_batch():
+    """
+    API endpoint to submit many price reports at once
+
+    The body is {"reports": [...]} where each report has shop_id,
+    product_alias_id, price_paid, optional quantity and an optional
+    "quality" object with the category's quality fields. Valid reports are
+    committed together; each result carries the new ids or an error. An
+    Idempotency-Key header (or "idempotency_key" field) makes retries
+    return the first response instead of saving the reports again.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return {"error": "JSON body is required"}, 400
+
+    reports = data.get('reports')
+    if not isinstance(reports, list) or not reports:
+        return {"error": "reports must be a non-empty list"}, 400
+    if len(reports) > MAX_BATCH_ITEMS:
+        return {"error": f"At most {MAX_BATCH_ITEMS} reports per batch"}, 400
+
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if idempotency_key is not None and (not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= 200):
+        return {"error": "Invalid idempotency key"}, 400
+
+    try:
+        response, replayed = submit_price_report_batch(db, session.get("user_id"), reports, idempotency_key)
+    except Exception as e:
+        print(f"Database error: {e}")
+        return {"error": "Failed to save price reports"}, 500
+
+    created_ids = [result['id'] for result in response['results'] if 'id' in result]
+    if not replayed and created_ids:
+        invalidate_cached_searches(*created_ids)
+
+    return {"success": True, "replayed": replayed, **response}
+
+
+@user_bp.route("/export/price_reports", methods=["GET"])
+@login_required
+def export_price_reports():
+    """Stream price reports as NDJSON or CSV, filtered by category, alias, date range and bounding box"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return {"error": "Format must be ndjson or csv"}, 400
+    
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    
+    serialize, mimetype = EXPORT_FORMATS[export_format]
+    response = current_app.response_class(
+        stream_with_context(serialize(iter_price_reports(filters))),
+        mimetype=mimetype
+    )
+    response.headers["Content-Disposition"] = f"attachment; filename=price_reports.{export_format}"
+    return response
+
+
+# Price reports at candidate shops from the spatial index, with quality scores
+SEARCH_REPORTS_COLUMNS = (
+    "SELECT pr.id, pr.price_paid, pr.quantity, pr.reported_at, "
+    "s.id AS shop_id, s.name AS shop_name, s.address, s.latitude, s.longitude, "
+    "pa.alias_name, p.canonical_name, p.category, "
+    "u.username, "
+    "qr.id AS quality_report_id, "
+    "qr.normalized_quality_score AS quality_score, "
+    f"pr.id IN {SUSPECT_REPORT_IDS} AS is_suspect "
+)
+# ({reports} is price_reports, or ALL_PRICE_REPORTS to include the archive)
+SEARCH_REPORTS_FROM = (
+    "FROM shops_rtree r "
+    "JOIN shops s ON s.id = r.id "
+    "JOIN {reports} pr ON pr.shop_id = s.id "
+    "JOIN product_aliases pa ON pr.product_alias_id = pa.id "
+    "JOIN products p ON pa.product_id = p.id "
+    "JOIN users u ON pr.user_id = u.id "
+    "LEFT JOIN quality_reports qr ON qr.price_report_id = pr.id "
+)
+
+SEARCH_REPORTS_JOIN = (
+    "JOIN {reports} pr ON pr.shop_id = s.id "
+    "JOIN product_aliases pa ON pr.product_alias_id = pa.id "
+)
+
+# Precomputed shop x product alias summaries at candidate shops, merged per
+# shop (a shop has one row per alias when searching a whole product)
+SHOP_SUMMARIES_COLUMNS = (
+    "SELECT s.id AS shop_id, s.name AS shop_name, s.address, s.latitude, s.longitude, "
+    "GROUP_CONCAT(DISTINCT pa.alias_name) AS alias_name, p.canonical_name, p.category, "
+    "SUM(sps.report_count) AS report_count, SUM(sps.unit_price_sum) AS unit_price_sum, "
+    "MIN(sps.min_unit_price) AS min_unit_price, MAX(sps.max_unit_price) AS max_unit_price, "
+    "SUM(sps.total_quantity) AS total_quantity, SUM(sps.total_spent) AS total_spent, "
+    "SUM(sps.quality_report_count) AS quality_report_count, "
+    "SUM(sps.quality_score_sum) AS quality_score_sum, SUM(sps.quality_score_count) AS quality_score_count, "
+    "MIN(sps.earliest_report_date) AS earliest_report_date, MAX(sps.latest_report_date) AS latest_report_date, "
+    "quantile_sketch_merge(sps.unit_price_sketch) AS unit_price_sketch "
+)
+
+# Shop count and unit price statistics over every matching summary, the
+# shops' sketches merged into one for area-wide percentiles
+SHOP_SUMMARIES_TOTALS = (
+    "COUNT(DISTINCT s.id) AS count, COUNT(DISTINCT s.id) AS shop_count, "
+    "SUM(sps.report_count) AS report_count, SUM(sps.unit_price_sum) AS unit_price_sum, "
+    "MIN(sps.min_unit_price) AS min_unit_price, MAX(sps.max_unit_price) AS max_unit_price, "
+    "quantile_sketch_merge(sps.unit_price_sketch) AS unit_price_sketch "
+)
+SHOP_SUMMARIES_JOIN = (
+    "JOIN shop_price_summaries sps ON sps.shop_id = s.id "
+    "JOIN product_aliases pa ON sps.product_alias_id = pa.id "
+)
+SHOP_SUMMARIES_FROM = (
+    "FROM shops_rtree r "
+    "JOIN shops s ON s.id = r.id "
+    + SHOP_SUMMARIES_JOIN
+    + "JOIN products p ON pa.product_id = p.id "
+)
+
+# Individual reports listed under each grouped shop; report_count still covers all
+MAX_GROUP_REPORTS = 20
+
+# Sort key expressions for (single reports, shops grouped from summaries)
+SEARCH_SORTS = {
+    'distance': None,
+    'unit_price': ("pr.price_paid / pr.quantity", "SUM(sps.unit_price_sum) / SUM(sps.report_count)"),
+    'min_unit_price': ("pr.price_paid / pr.quantity", "MIN(sps.min_unit_price)"),
+}
+
+
 @user_bp.route("/api/search/price_reports", methods=["POST"])
 @login_required
 def search_price_reports():
-    """API endpoint to search price reports by location and filters with pagination"""
+    """
+    API endpoint to search price reports by location and filters with pagination
+
+    Pages are addressed either by `page` number or by the opaque `cursor`
+    token returned as `next_cursor`. Cursor requests skip the total count
+    unless `include_total` is set.
+
+    Results are ordered by distance unless `sort` is `unit_price` (grouped:
+    average unit price) or `min_unit_price`. `top_k` returns only the first
+    k results in that order, cheapest first by default, without paging.
+
+    Only the hot price_reports table is searched unless `include_archive`
+    is set or a `start_date`/`end_date` range (YYYY-MM-DD, inclusive)
+    reaches back into the archive. `exclude_suspect` leaves out reports
+    flagged as price outliers, from the results and the grouped statistics.
+    """
     try:
         # Get JSON data from request
         data = request.get_json()
         
         product_alias_id = data.get('product_alias_id')
+        product_id = data.get('product_id')
         user_lat = data.get('latitude')
         user_lon = data.get('longitude')
         max_distance = data.get('distance', 10)  # Default 10km
         page = data.get('page', 1)
         per_page = data.get('per_page', 10)
         group_by_shop = data.get('group_by_shop', False)  # New parameter
+        top_k = data.get('top_k')
+        sort = data.get('sort', 'unit_price' if top_k else 'distance')
+        use_cursor = 'cursor' in data
+        cursor = data.get('cursor')
+        # Page-number requests always need the total for their page links
+        include_total = data.get('include_total', False) or not (use_cursor or top_k)
+        include_archive = bool(data.get('include_archive', False))
+        exclude_suspect = bool(data.get('exclude_suspect', False))
         
         # Validate inputs
-        if not product_alias_id:
-            return {"error": "Product alias is required"}, 400
+        if not product_alias_id and not product_id:
+            return {"error": "Product alias or product is required"}, 400
         if not user_lat or not user_lon:
             return {"error": "Location is required"}, 400
         
         try:
-            product_alias_id = int(product_alias_id)
+            product_alias_id = int(product_alias_id) if product_alias_id else None
+            product_id = int(product_id) if product_id and not product_alias_id else None
             user_lat = float(user_lat)
             user_lon = float(user_lon)
             max_distance = float(max_distance)
             page = int(page)
             per_page = int(per_page)
+            top_k = int(top_k) if top_k else None
         except (ValueError, TypeError):
             return {"error": "Invalid input data"}, 400
+        if not all(math.isfinite(value) for value in (user_lat, user_lon, max_distance)):
+            return {"error": "Invalid input data"}, 400
+        
+        try:
+            dates = parse_export_filters({'start_date': data.get('start_date'), 'end_date': data.get('end_date')})
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        start_date, end_date = dates.get('start_date'), dates.get('end_date')
         
         if max_distance <= 0 or max_distance > 100:
             return {"error": "Distance must be between 0 and 100 km"}, 400
         
+        if sort not in SEARCH_SORTS:
+            return {"error": "Invalid sort"}, 400
+        if top_k is not None and (top_k < 1 or top_k > 100):
+            return {"error": "top_k must be between 1 and 100"}, 400
+        
         if page < 1:
             page = 1
         if per_page < 1 or per_page > 50:
             per_page = 10
+        if top_k:
+            page, per_page, use_cursor, cursor = 1, top_k, False, None
+        
+        after = None
+        if cursor:
+            after = decode_search_cursor(cursor)
+            if after is None:
+                return {"error": "Invalid cursor"}, 400
+        
+        # Nearby users share cached results for their grid cell, so the
+        # search runs from the cell centre; apps on other files do not
+        user_lat, user_lon = quantize_location(user_lat, user_lon)
+        cache_key = (db.path, product_alias_id, product_id, user_lat, user_lon, max_distance, bool(group_by_shop),
+                     sort, top_k, page, per_page, cursor, include_total, include_archive, exclude_suspect,
+                     start_date, end_date)
+        body = search_cache.get(cache_key)
+        if body is not None:
+            return current_app.response_class(body, mimetype="application/json")
         
         offset = (page - 1) * per_page
         
-        # Get all price reports for the selected product alias with quality scores
-        all_reports = db.execute(
-            "SELECT pr.id, pr.price_paid, pr.quantity, pr.reported_at, "
-            "s.id AS shop_id, s.name AS shop_name, s.address, s.latitude, s.longitude, "
-            "pa.alias_name, p.canonical_name, p.category, "
-            "u.username, "
-            "qr.id AS quality_report_id, "
-            "COALESCE(eq.normalized_quality_score, pq.normalized_quality_score, fq.normalized_quality_score, aq.normalized_quality_score) AS quality_score "
-            "FROM price_reports pr "
-            "JOIN shops s ON pr.shop_id = s.id "
-            "JOIN product_aliases pa ON pr.product_alias_id = pa.id "
-            "JOIN products p ON pa.product_id = p.id "
-            "JOIN users u ON pr.user_id = u.id "
-            "LEFT JOIN quality_reports qr ON qr.price_report_id = pr.id "
-            "LEFT JOIN electronics_quality_reports eq ON eq.quality_report_id = qr.id "
-            "LEFT JOIN pharma_quality_reports pq ON pq.quality_report_id = qr.id "
-            "LEFT JOIN food_quality_reports fq ON fq.quality_report_id = qr.id "
-            "LEFT JOIN apparel_quality_reports aq ON aq.quality_report_id = qr.id "
-            "WHERE pa.id = ? "
-            "ORDER BY pr.reported_at DESC",
-            product_alias_id
-        )
+        # Only shops inside the bounding box of the search radius are candidates
+        bbox = bounding_box(user_lat, user_lon, max_distance)
         
-        # Calculate distance and filter
-        import math
-        
-        def haversine_distance(lat1, lon1, lat2, lon2):
-            """Calculate distance between two points in kilometers using Haversine formula"""
-            R = 6371  # Earth's radius in kilometers
-            
-            lat1_rad = math.radians(lat1)
-            lat2_rad = math.radians(lat2)
-            delta_lat = math.radians(lat2 - lat1)
-            delta_lon = math.radians(lon2 - lon1)
-            
-            a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2) ** 2
-            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-            
-            return R * c
-        
-        # Filter by distance and add distance to each report
-        filtered_reports = []
-        for report in all_reports:
-            distance = haversine_distance(user_lat, user_lon, report['latitude'], report['longitude'])
-            if distance <= max_distance:
-                report['distance'] = round(distance, 2)
-                report['unit_price'] = round(report['price_paid'] / report['quantity'], 2)
-                filtered_reports.append(report)
+        reports_source = price_reports_source(db, include_archive, start_date, end_date)
+        # Conditions on the reports themselves (dates, suspect flags)
+        conditions_sql = ""
+        conditions_args = []
+        if start_date:
+            conditions_sql += "AND pr.reported_at >= ? "
+            conditions_args.append(start_date.isoformat())
+        if end_date:
+            conditions_sql += "AND pr.reported_at < ? "
+            conditions_args.append((end_date + timedelta(days=1)).isoformat())
+        if exclude_suspect:
+            conditions_sql += f"AND pr.id NOT IN {SUSPECT_REPORT_IDS} "
         
-        # Group by shop if requested
-        if group_by_shop:
-            filtered_reports = group_reports_by_shop(filtered_reports)
+        # The summaries cover exactly the hot table, so grouping anything
+        # else (archive, date range, suspects left out) aggregates the
+        # selected reports instead
+        group_from_reports = group_by_shop and (reports_source != "price_reports" or bool(conditions_sql))
         
-        # Sort by distance (closest first)
-        filtered_reports.sort(key=lambda x: x['distance'])
+        if group_by_shop and not group_from_reports:
+            # Precomputed summary rows per nearby shop instead of every report
+            columns, from_sql, count_join_sql = SHOP_SUMMARIES_COLUMNS, SHOP_SUMMARIES_FROM, SHOP_SUMMARIES_JOIN
+            alias_column, id_column = "sps.product_alias_id", "s.id"
+            group_sql, count_sql = "GROUP BY s.id ", SHOP_SUMMARIES_TOTALS
+        else:
+            columns = SEARCH_REPORTS_COLUMNS
+            from_sql = SEARCH_REPORTS_FROM.format(reports=reports_source)
+            count_join_sql = SEARCH_REPORTS_JOIN.format(reports=reports_source)
+            alias_column, id_column = "pr.product_alias_id", "pr.id"
+            group_sql, count_sql = "", "COUNT(*) AS count "
         
-        # Calculate pagination
-        total_reports = len(filtered_reports)
-        total_pages = math.ceil(total_reports / per_page) if total_reports > 0 else 1
+        # A product search covers every alias of the product in the same pass
+        if product_id is not None:
+            filter_sql = reports_filter_sql = "pa.product_id = ? "
+            filter_value = product_id
+        else:
+            filter_sql, reports_filter_sql = f"{alias_column} = ? ", "pr.product_alias_id = ? "
+            filter_value = product_alias_id
         
-        # Get paginated slice
-        paginated_reports = filtered_reports[offset:offset + per_page]
+        # Price orderings rank by an extra sort_key column; for single reports
+        # it matches the (alias, unit price) index, so SQLite can walk it in
+        # order and stop after LIMIT rows within the radius
+        sort_column = "distance"
+        sort_key_sql = ""
+        if sort != 'distance':
+            sort_column = "sort_key"
+            sort_key_sql = f", {SEARCH_SORTS[sort][1 if group_by_shop else 0]} AS sort_key "
         
-        return {
-            "success": True,
-            "reports": paginated_reports,
-            "pagination": {
+        # Distance filter, ordering and paging all run inside SQLite; with a
+        # cursor the scan starts right after the last (sort value, id) seen.
+        # Grouped sort keys are aggregates, so their keyset goes in HAVING
+        keyset_sql = ""
+        keyset_args = []
+        if after is not None:
+            keyset_sql = f"(({sort_column} > ?) OR ({sort_column} = ? AND {id_column} > ?)) "
+            keyset_args = [after[0], after[0], after[1]]
+        where_keyset_sql = "AND " + keyset_sql if keyset_sql and not group_by_shop else ""
+        having_keyset_sql = "HAVING " + keyset_sql if keyset_sql and group_by_shop else ""
+        
+        # One extra row tells whether another page follows
+        area = None
+        if group_from_reports:
+            rows, area = group_search_reports(
+                from_sql, reports_filter_sql, filter_value, conditions_sql, conditions_args,
+                user_lat, user_lon, bbox, max_distance, sort
+            )
+            total_reports = len(rows)
+            if after is not None:
+                rows = [row for row in rows if (row[sort_column], row['shop_id']) > after]
+            rows = rows[0 if use_cursor else offset:][:per_page + 1]
+        else:
+            rows = db.execute(
+                columns
+                + ", haversine(?, ?, s.latitude, s.longitude) AS distance "
+                + sort_key_sql
+                + from_sql
+                + "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+                "AND " + filter_sql
+                + "AND distance <= ? "
+                + conditions_sql
+                + where_keyset_sql
+                + group_sql
+                + having_keyset_sql
+                + f"ORDER BY {sort_column}, {id_column} "
+                "LIMIT ? OFFSET ?",
+                user_lat,
+                user_lon,
+                *bbox,
+                filter_value,
+                max_distance,
+                *conditions_args,
+                *keyset_args,
+                per_page + 1,
+                0 if use_cursor else offset
+            )
+        has_next = len(rows) > per_page
+        paginated_reports = rows[:per_page]
+        
+        next_cursor = None
+        if has_next:
+            last = paginated_reports[-1]
+            next_cursor = encode_search_cursor(last[sort_column], last['shop_id'] if group_by_shop else last['id'])
+        if sort_key_sql:
+            for row in paginated_reports:
+                del row['sort_key']
+        
+        if group_by_shop and not group_from_reports:
+            paginated_reports = build_shop_groups(paginated_reports, reports_filter_sql, filter_value)
+        elif not group_by_shop:
+            for report in paginated_reports:
+                report['distance'] = round(report['distance'], 2)
+                report['unit_price'] = round(report['price_paid'] / report['quantity'], 2)
+        
+        # Grouped searches always report area-wide price statistics
+        if (include_total or group_by_shop) and not group_from_reports:
+            totals = db.execute(
+                f"SELECT {count_sql}"
+                "FROM shops_rtree r "
+                "JOIN shops s ON s.id = r.id "
+                + count_join_sql
+                + "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+                "AND " + filter_sql
+                + "AND haversine(?, ?, s.latitude, s.longitude) <= ? "
+                + conditions_sql,
+                *bbox,
+                filter_value,
+                user_lat,
+                user_lon,
+                max_distance,
+                *conditions_args
+            )[0]
+            total_reports = totals['count']
+            if group_by_shop:
+                area = area_stats(totals)
+        
+        # Calculate pagination
+        if top_k:
+            pagination = {
+                "top_k": top_k,
+                "returned": len(paginated_reports)
+            }
+        elif use_cursor:
+            pagination = {
+                "per_page": per_page,
+                "has_next": has_next,
+                "next_cursor": next_cursor
+            }
+            if include_total:
+                pagination["total_reports"] = total_reports
+                pagination["total_pages"] = math.ceil(total_reports / per_page) if total_reports > 0 else 1
+        else:
+            total_pages = math.ceil(total_reports / per_page) if total_reports > 0 else 1
+            pagination = {
                 "current_page": page,
                 "per_page": per_page,
                 "total_reports": total_reports,
                 "total_pages": total_pages,
-                "has_next": page < total_pages,
-                "has_prev": page > 1
-            },
+                "has_next": has_next,
+                "has_prev": page > 1,
+                "next_cursor": next_cursor
+            }
+        
+        result = {
+            "success": True,
+            "reports": paginated_reports,
+            "pagination": pagination,
+            "area_stats": area,
             "filters": {
                 "product_alias_id": product_alias_id,
+                "product_id": product_id,
                 "max_distance": max_distance,
                 "group_by_shop": group_by_shop,
+                "sort": sort,
+                "top_k": top_k,
+                "include_archive": include_archive,
+                "exclude_suspect": exclude_suspect,
+                "start_date": start_date.isoformat() if start_date else None,
+                "end_date": end_date.isoformat() if end_date else None,
                 "user_location": {
                     "latitude": user_lat,
                     "longitude": user_lon
@@ -826,15 +943,155 @@ def search_price_reports():
             }
         }
         
+        body = current_app.json.dumps(result)
+        search_cache.put(cache_key, body, user_lat, user_lon, max_distance,
+                         product_alias_id=product_alias_id, product_id=product_id)
+        return current_app.response_class(body, mimetype="application/json")
+        
     except Exception as e:
         print(f"Error in search_price_reports: {e}")
         return {"error": "Failed to search price reports"}, 500
 
 
+def build_shop_groups(summaries, filter_sql, filter_value):
+    """
+    Expand a page of shop summary rows into grouped results with their latest
+    MAX_GROUP_REPORTS individual reports
+
+    filter_sql is the alias or product condition on price_reports/product_aliases
+    that selected the summaries, with filter_value as its parameter.
+    """
+    if not summaries:
+        return []
+    
+    shop_reports = {summary['shop_id']: [] for summary in summaries}
+    reports = db.execute(
+        "SELECT * FROM ("
+        + SEARCH_REPORTS_COLUMNS
+        + ", ROW_NUMBER() OVER (PARTITION BY pr.shop_id ORDER BY pr.reported_at DESC, pr.id DESC) AS position "
+        + SEARCH_REPORTS_FROM.format(reports="price_reports")
+        + "WHERE " + filter_sql
+        + "AND pr.shop_id IN (?)"
+        ") WHERE position <= ? "
+        "ORDER BY reported_at DESC, id DESC",
+        filter_value,
+        list(shop_reports),
+        MAX_GROUP_REPORTS
+    )
+    for report in reports:
+        del report['position']
+        shop_reports[report['shop_id']].append(report)
+    
+    # Reporters are counted over every report, not just the ones shown
+    shop_reporters = {shop_id: [] for shop_id in shop_reports}
+    reporters = db.execute(
+        "SELECT DISTINCT pr.shop_id, u.username "
+        "FROM price_reports pr "
+        "JOIN product_aliases pa ON pr.product_alias_id = pa.id "
+        "JOIN users u ON pr.user_id = u.id "
+        "WHERE " + filter_sql
+        + "AND pr.shop_id IN (?)",
+        filter_value,
+        list(shop_reports)
+    )
+    for reporter in reporters:
+        shop_reporters[reporter['shop_id']].append(reporter['username'])
+    
+    grouped_reports = []
+    for summary in summaries:
+        distance = round(summary['distance'], 2)
+        individual_reports = shop_reports[summary['shop_id']]
+        for report in individual_reports:
+            report['distance'] = distance
+            report['unit_price'] = round(report['price_paid'] / report['quantity'], 2)
+        
+        # Use the latest report as base
+        grouped = individual_reports[0].copy() if individual_reports else {}
+        grouped.update({
+            'shop_id': summary['shop_id'],
+            'shop_name': summary['shop_name'],
+            'address': summary['address'],
+            'latitude': summary['latitude'],
+            'longitude': summary['longitude'],
+            'alias_name': summary['alias_name'],
+            'canonical_name': summary['canonical_name'],
+            'category': summary['category'],
+            'distance': distance,
+        })
+        grouped.update(summary_stats(summary))
+        grouped['reporters'] = shop_reporters[summary['shop_id']]
+        grouped['individual_reports'] = individual_reports  # Latest MAX_GROUP_REPORTS, for details
+        grouped['is_grouped'] = True
+        
+        # Override unit_price with average
+        grouped['unit_price'] = grouped['avg_unit_price']
+        
+        grouped_reports.append(grouped)
+    
+    return grouped_reports
+
+
+def group_search_reports(from_sql, filter_sql, filter_value, conditions_sql, conditions_args,
+                         user_lat, user_lon, bbox, max_distance, sort):
+    """
+    Group every matching report within the radius by shop, in search order
+
+    Used when the selected reports are not what the shop summaries cover
+    (archive included or a date range), so the statistics are computed
+    from exactly those reports. Groups carry a sort_key for price sorts.
+    Returns (groups, area-wide statistics).
+    """
+    reports = db.execute(
+        SEARCH_REPORTS_COLUMNS
+        + ", haversine(?, ?, s.latitude, s.longitude) AS distance "
+        + from_sql
+        + "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+        "AND " + filter_sql
+        + "AND distance <= ? "
+        + conditions_sql
+        + "ORDER BY pr.reported_at DESC",
+        user_lat,
+        user_lon,
+        *bbox,
+        filter_value,
+        max_distance,
+        *conditions_args
+    )
+    for report in reports:
+        report['distance'] = round(report['distance'], 2)
+        report['unit_price'] = report['price_paid'] / report['quantity']
+    
+    groups = group_reports_by_shop(reports)
+    for group in groups:
+        group['alias_name'] = ",".join(dict.fromkeys(r['alias_name'] for r in group['individual_reports']))
+        # Reports come newest first, as build_shop_groups lists them
+        group['individual_reports'] = group['individual_reports'][:MAX_GROUP_REPORTS]
+        for report in group['individual_reports']:
+            report['unit_price'] = round(report['unit_price'], 2)
+        if sort != 'distance':
+            group['sort_key'] = group['avg_unit_price' if sort == 'unit_price' else 'min_unit_price']
+    
+    groups.sort(key=lambda group: (group['distance' if sort == 'distance' else 'sort_key'], group['shop_id']))
+    
+    # Area-wide statistics in the same form as the merged shop summaries
+    unit_prices = [report['price_paid'] / report['quantity'] for report in reports]
+    sketch = {}
+    for unit_price in unit_prices:
+        sketch_add(sketch, unit_price)
+    area = area_stats({
+        'shop_count': len(groups),
+        'report_count': len(unit_prices),
+        'unit_price_sum': sum(unit_prices),
+        'min_unit_price': min(unit_prices, default=None),
+        'max_unit_price': max(unit_prices, default=None),
+        'unit_price_sketch': dump_sketch(sketch),
+    })
+    return groups, area
+
+
 def group_reports_by_shop(reports):
     """Group multiple reports from the same shop and calculate statistics"""
     from collections import defaultdict
-    from datetime import datetime
     
     shop_groups = defaultdict(list)
     
@@ -854,25 +1111,28 @@ def group_reports_by_shop(reports):
         quantities = [r['quantity'] for r in shop_reports]
         total_paid = [r['price_paid'] for r in shop_reports]
         quality_count = sum(1 for r in shop_reports if r['quality_report_id'])
+        report_dates = [r['reported_at'] for r in shop_reports]
+        sketch = {}
+        for price in prices:
+            sketch_add(sketch, price)
         
         # Calculate average quality score for reports with quality data
         quality_scores = [r['quality_score'] for r in shop_reports if r['quality_score'] is not None]
         avg_quality_score = round(sum(quality_scores) / len(quality_scores), 2) if quality_scores else None
         
-        # Sort by date to get latest and earliest
-        shop_reports_sorted = sorted(shop_reports, key=lambda x: x['reported_at'])
-        
         # Aggregate data
         base_report['report_count'] = len(shop_reports)
         base_report['avg_unit_price'] = round(sum(prices) / len(prices), 2)
         base_report['min_unit_price'] = round(min(prices), 2)
         base_report['max_unit_price'] = round(max(prices), 2)
+        for name, value in sketch_quantiles(sketch, min(prices), max(prices)).items():
+            base_report[f'{name}_unit_price'] = value
         base_report['total_quantity'] = sum(quantities)
         base_report['total_spent'] = round(sum(total_paid), 2)
         base_report['quality_report_count'] = quality_count
         base_report['avg_quality_score'] = avg_quality_score
-        base_report['latest_report_date'] = shop_reports_sorted[-1]['reported_at']
-        base_report['earliest_report_date'] = shop_reports_sorted[0]['reported_at']
+        base_report['latest_report_date'] = max(report_dates)
+        base_report['earliest_report_date'] = min(report_dates)
         base_report['reporters'] = list(set(r['username'] for r in shop_reports))
         base_report['individual_reports'] = shop_reports  # Keep individual reports for details
         base_report['is_grouped'] = True
@@ -882,4 +1142,4 @@ def group_reports_by_shop(reports):
         
         aggregated_reports.append(base_report)
     
-    return aggregated_reports
\ No newline at end of file
+    return aggregated_reports
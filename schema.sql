@@ -0,0 +1,340 @@
+-- Base schema for app.db.
+--
+-- Create a fresh database with:
+--
+--     sqlite3 app.db < schema.sql
+--
+-- Indexes and later schema changes are not listed here; they are applied
+-- by migrations.py at startup (or with `flask migrate`) and recorded in
+-- the schema_version table.
+
+CREATE TABLE products (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  canonical_name TEXT NOT NULL,
+  category TEXT NOT NULL CHECK (
+    category IN ('electronics','pharma','apparel','food')
+  ),
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE product_aliases (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  product_id INTEGER NOT NULL,
+  alias_name TEXT NOT NULL,
+
+  FOREIGN KEY (product_id) REFERENCES products(id),
+  UNIQUE (product_id, alias_name)
+);
+
+CREATE TABLE price_reports (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER NOT NULL,
+  shop_id INTEGER NOT NULL,
+  product_alias_id INTEGER NOT NULL,
+  price_paid REAL NOT NULL,
+  quantity INTEGER NOT NULL DEFAULT 1,
+  reported_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  FOREIGN KEY (user_id) REFERENCES users(id),
+  FOREIGN KEY (shop_id) REFERENCES shops(id),
+  FOREIGN KEY (product_alias_id) REFERENCES product_aliases(id)
+);
+
+CREATE TABLE electronics_quality_reports (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+  quality_report_id INTEGER NOT NULL UNIQUE,
+
+  device_functional INTEGER NOT NULL CHECK (device_functional IN (0, 1)),
+
+  authenticity_confidence INTEGER NOT NULL
+    CHECK (authenticity_confidence BETWEEN 1 AND 5),
+
+  condition_match INTEGER NOT NULL
+    CHECK (condition_match BETWEEN 1 AND 5),
+
+  warranty_honored INTEGER
+    CHECK (warranty_honored IN (0, 1)),
+
+  accessories_complete INTEGER NOT NULL
+    CHECK (accessories_complete IN (0, 1)),
+
+  reported_issue TEXT,
+
+  normalized_quality_score REAL NOT NULL
+    CHECK (normalized_quality_score BETWEEN 0.0 AND 1.0),
+
+  scoring_version TEXT NOT NULL,
+
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  FOREIGN KEY (quality_report_id)
+    REFERENCES quality_reports(id)
+    ON DELETE CASCADE
+);
+
+CREATE TRIGGER enforce_single_category_electronics
+BEFORE INSERT ON electronics_quality_reports
+BEGIN
+  SELECT
+    CASE
+      WHEN EXISTS (
+        SELECT 1 FROM pharma_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      OR EXISTS (
+        SELECT 1 FROM food_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      OR EXISTS (
+        SELECT 1 FROM apparel_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      THEN RAISE(ABORT, 'Quality report already assigned to another category')
+    END;
+END;
+
+CREATE TABLE food_quality_reports (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+  quality_report_id INTEGER NOT NULL UNIQUE,
+
+  packaging_intact INTEGER NOT NULL CHECK (packaging_intact IN (0,1)),
+
+  expiry_status TEXT CHECK (expiry_status IN ('valid','near_expiry','expired','missing')) NOT NULL,
+
+  weight_or_volume_matches_label INTEGER NOT NULL CHECK (weight_or_volume_matches_label IN (0,1)),
+
+  visible_spoilage_present INTEGER NOT NULL CHECK (visible_spoilage_present IN (0,1)),
+
+  abnormal_smell_or_appearance INTEGER NOT NULL CHECK (abnormal_smell_or_appearance IN (0,1)),
+
+  evidence_photos TEXT,
+
+  normalized_quality_score REAL NOT NULL CHECK (normalized_quality_score BETWEEN 0.0 AND 1.0),
+
+  scoring_version TEXT NOT NULL,
+
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  FOREIGN KEY (quality_report_id)
+    REFERENCES quality_reports(id)
+    ON DELETE CASCADE
+);
+
+CREATE TRIGGER enforce_single_category_food
+BEFORE INSERT ON food_quality_reports
+BEGIN
+  SELECT
+    CASE
+      WHEN EXISTS (
+        SELECT 1 FROM electronics_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      OR EXISTS (
+        SELECT 1 FROM pharma_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      OR EXISTS (
+        SELECT 1 FROM apparel_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      THEN RAISE(ABORT, 'Quality report already assigned to another category')
+    END;
+END;
+
+CREATE TABLE apparel_quality_reports (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+  quality_report_id INTEGER NOT NULL UNIQUE,
+
+  material_quality TEXT CHECK (material_quality IN ('as_expected','below_expected','poor')) NOT NULL,
+
+  stitching_quality TEXT CHECK (stitching_quality IN ('intact','minor_defects','major_defects')) NOT NULL,
+
+  fit_consistency TEXT CHECK (fit_consistency IN ('as_expected','tight','loose','inconsistent')) NOT NULL,
+
+  early_wear_present INTEGER NOT NULL CHECK (early_wear_present IN (0,1)),
+
+  color_or_print_fading INTEGER NOT NULL CHECK (color_or_print_fading IN (0,1)),
+
+  evidence_photos TEXT,
+
+  normalized_quality_score REAL NOT NULL CHECK (normalized_quality_score BETWEEN 0.0 AND 1.0),
+
+  scoring_version TEXT NOT NULL,
+
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  FOREIGN KEY (quality_report_id)
+    REFERENCES quality_reports(id)
+    ON DELETE CASCADE
+);
+
+CREATE TRIGGER enforce_single_category_apparel
+BEFORE INSERT ON apparel_quality_reports
+BEGIN
+  SELECT
+    CASE
+      WHEN EXISTS (
+        SELECT 1 FROM electronics_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      OR EXISTS (
+        SELECT 1 FROM pharma_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      OR EXISTS (
+        SELECT 1 FROM food_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      THEN RAISE(ABORT, 'Quality report already assigned to another category')
+    END;
+END;
+
+CREATE TABLE pharma_quality_reports (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+  quality_report_id INTEGER NOT NULL UNIQUE,
+
+  packaging_sealed INTEGER NOT NULL CHECK (packaging_sealed IN (0,1)),
+
+  expiry_date_present INTEGER NOT NULL CHECK (expiry_date_present IN (0,1)),
+
+  expiry_status TEXT CHECK (expiry_status IN ('valid','near_expiry','expired')) NOT NULL,
+
+  label_completeness TEXT CHECK (label_completeness IN ('complete','partial','missing')) NOT NULL,
+
+  dosage_label_matches_expected INTEGER NOT NULL CHECK (dosage_label_matches_expected IN (0,1)),
+
+  physical_anomalies_present INTEGER NOT NULL CHECK (physical_anomalies_present IN (0,1)),
+
+  evidence_photos TEXT,
+
+  normalized_quality_score REAL NOT NULL CHECK (normalized_quality_score BETWEEN 0.0 AND 1.0),
+
+  scoring_version TEXT NOT NULL,
+
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+  FOREIGN KEY (quality_report_id)
+    REFERENCES quality_reports(id)
+    ON DELETE CASCADE
+);
+
+CREATE TRIGGER enforce_single_category_pharma
+BEFORE INSERT ON pharma_quality_reports
+BEGIN
+  SELECT
+    CASE
+      WHEN EXISTS (
+        SELECT 1 FROM electronics_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      OR EXISTS (
+        SELECT 1 FROM food_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      OR EXISTS (
+        SELECT 1 FROM apparel_quality_reports
+        WHERE quality_report_id = NEW.quality_report_id
+      )
+      THEN RAISE(ABORT, 'Quality report already assigned to another category')
+    END;
+END;
+
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL UNIQUE,
+    passhash TEXT NOT NULL,
+
+    user_type TEXT NOT NULL CHECK (
+        user_type IN ('user', 'admin')
+    ),
+
+    reputation REAL DEFAULT 0 CHECK (reputation >= 0),
+
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE shop_proposals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+    proposed_name TEXT NOT NULL,
+    proposed_address TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+
+    proposed_by INTEGER NOT NULL,
+    status TEXT NOT NULL CHECK (
+        status IN ('pending', 'approved', 'rejected')
+    ) DEFAULT 'pending',
+
+    reviewed_by INTEGER,
+    reviewed_at TEXT,
+
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (proposed_by) REFERENCES users(id),
+    FOREIGN KEY (reviewed_by) REFERENCES users(id)
+);
+
+CREATE TABLE product_alias_proposals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+    product_id INTEGER NOT NULL,
+    proposed_alias TEXT NOT NULL,
+
+    proposed_by INTEGER NOT NULL,
+    status TEXT NOT NULL CHECK (
+        status IN ('pending', 'approved', 'rejected')
+    ) DEFAULT 'pending',
+
+    reviewed_by INTEGER,
+    reviewed_at TEXT,
+
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (product_id) REFERENCES products(id),
+    FOREIGN KEY (proposed_by) REFERENCES users(id),
+    FOREIGN KEY (reviewed_by) REFERENCES users(id)
+);
+
+CREATE TABLE shops (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    address TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE price_report_votes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+    price_report_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+
+    vote INTEGER NOT NULL CHECK (vote IN (-1, 1)),
+
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+
+    UNIQUE (price_report_id, user_id),
+
+    FOREIGN KEY (price_report_id) REFERENCES price_reports(id),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+CREATE TABLE quality_reports (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  price_report_id INTEGER NOT NULL UNIQUE,
+  user_id INTEGER NOT NULL,
+  category TEXT NOT NULL CHECK (category IN ('electronics','pharma','apparel','food')),
+  confidence_score REAL DEFAULT 0.5 CHECK (confidence_score BETWEEN 0 AND 1),
+  created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (price_report_id) REFERENCES price_reports(id),
+  FOREIGN KEY (user_id) REFERENCES users(id)
+);
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+
+from geo import haversine_distance
+
+# Searches are cached per grid cell of 10^-3 degrees (about 110 m)
+CELL_DECIMALS = 3
+
+
+def quantize_location(lat, lon):
+    """Snap a location to the centre of its cache grid cell"""
+    return round(lat, CELL_DECIMALS), round(lon, CELL_DECIMALS)
+
+
+class SearchCache:
+    """
+    In-process LRU cache of serialized nearby-price search responses.
+
+    Entries expire after ttl seconds and the least recently used ones are
+    evicted once either max_entries or max_bytes is exceeded. Each entry
+    remembers the alias and search circle it covers so writes can drop only
+    the results they affect.
+    """
+
+    def __init__(self, ttl=60, max_entries=1024, max_bytes=32 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached body for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry['expires_at'] <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['body']
+
+    def put(self, key, body, lat, lon, radius, product_alias_id=None, product_id=None):
+        """
+        Store a serialized response for a search around (lat, lon) within
+        radius km, for a single alias or for every alias of a product
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                'body': body,
+                'product_alias_id': product_alias_id,
+                'product_id': product_id,
+                'lat': lat,
+                'lon': lon,
+                'radius': radius,
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, lat=None, lon=None, product_alias_id=None, product_id=None):
+        """
+        Drop entries touched by a write.
+
+        With a location, only searches whose circle contains it are dropped.
+        With product_alias_id and/or product_id, only searches for that alias
+        or for that product as a whole. Calling with nothing clears the cache.
+        """
+        any_product = product_alias_id is None and product_id is None
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if (any_product
+                    or (product_alias_id is not None and entry['product_alias_id'] == product_alias_id)
+                    or (product_id is not None and entry['product_id'] == product_id))
+                and (lat is None or lon is None
+                     or haversine_distance(entry['lat'], entry['lon'], lat, lon) <= entry['radius'])
+            ]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        """Drop every entry"""
+        self.invalidate()
+
+    def stats(self):
+        """Counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry['body'])
+
+
+# Shared by the search endpoint and every writer that must invalidate it
+search_cache = SearchCache()
@@ -0,0 +1,121 @@
+import json
+import math
+
+# Unit prices are summarized in mergeable quantile sketches: bucket i
+# counts the values in (GAMMA^(i-1), GAMMA^i], so a quantile read back is
+# within RELATIVE_ACCURACY of a true value at that rank. Merging sketches
+# adds their bucket counts, which is exactly the sketch of the combined
+# values. Sketches are stored as JSON objects of bucket index to count.
+
+# Relative error of a quantile read back from a sketch
+RELATIVE_ACCURACY = 0.01
+
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+# Bucket for zero and negative values, which have no logarithm
+_ZERO_BUCKET = "z"
+
+# Percentiles reported alongside the average, minimum and maximum
+PERCENTILES = (('p25', 0.25), ('p50', 0.5), ('p75', 0.75))
+
+
+def sketch_bucket(value):
+    """Key of the bucket a value is counted in"""
+    if value <= 0:
+        return _ZERO_BUCKET
+    return str(math.ceil(math.log(value) / _LOG_GAMMA))
+
+
+def sketch_add(counts, value):
+    """Count a value in a sketch's bucket counts (a dict, updated in place)"""
+    bucket = sketch_bucket(value)
+    counts[bucket] = counts.get(bucket, 0) + 1
+
+
+def sketch_merge(counts, other):
+    """Add other's bucket counts into counts (updated in place)"""
+    for bucket, count in other.items():
+        counts[bucket] = counts.get(bucket, 0) + count
+
+
+def sketch_quantiles(counts, low=None, high=None):
+    """
+    The PERCENTILES of a sketch as {name: value}, or None values for an
+    empty sketch. low and high, the exact minimum and maximum when known,
+    clamp the estimates.
+    """
+    total = sum(counts.values())
+    if not total:
+        return {name: None for name, _ in PERCENTILES}
+
+    ordered = sorted(
+        (-math.inf if bucket == _ZERO_BUCKET else int(bucket), count) for bucket, count in counts.items()
+    )
+    quantiles = {}
+    for name, q in PERCENTILES:
+        rank = q * (total - 1)
+        seen = 0
+        for index, count in ordered:
+            seen += count
+            if seen > rank:
+                break
+        # Midpoint of the bucket in relative terms
+        value = 0.0 if index == -math.inf else 2 * GAMMA ** index / (GAMMA + 1)
+        if low is not None:
+            value = max(value, low)
+        if high is not None:
+            value = min(value, high)
+        quantiles[name] = round(value, 2)
+    return quantiles
+
+
+def load_sketch(text):
+    """Bucket counts from a stored sketch (None or empty for no values)"""
+    return json.loads(text) if text else {}
+
+
+def dump_sketch(counts):
+    """Stored form of a sketch's bucket counts"""
+    return json.dumps(counts, separators=(",", ":"), sort_keys=True)
+
+
+class QuantileSketchAggregate:
+    """SQL aggregate quantile_sketch(value): the sketch of a column's values"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def step(self, value):
+        if value is not None:
+            sketch_add(self.counts, value)
+
+    def finalize(self):
+        return dump_sketch(self.counts)
+
+
+class SketchMergeAggregate:
+    """SQL aggregate quantile_sketch_merge(sketch): the merge of a column's sketches"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def step(self, text):
+        sketch_merge(self.counts, load_sketch(text))
+
+    def finalize(self):
+        return dump_sketch(self.counts)
+
+
+def merge_sketch_texts(a, b):
+    """SQL function quantile_sketch_merge(a, b): the merge of two stored sketches"""
+    counts = load_sketch(a)
+    sketch_merge(counts, load_sketch(b))
+    return dump_sketch(counts)
+
+
+def register_sketch_functions(connection):
+    """Make the sketch functions available in SQL on a sqlite3 connection"""
+    connection.create_aggregate("quantile_sketch", 1, QuantileSketchAggregate)
+    connection.create_aggregate("quantile_sketch_merge", 1, SketchMergeAggregate)
+    connection.create_function("quantile_sketch_merge", 2, merge_sketch_texts, deterministic=True)
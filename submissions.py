@@ -0,0 +1,202 @@
+import json
+
+from aggregates import record_price_report
+from helpers import parse_price_report
+from outliers import score_price_report
+from quality import SCORERS, parse_quality_data, write_quality_report
+from trends import record_price_report_day
+
+# Largest number of reports accepted in one batch
+MAX_BATCH_ITEMS = 500
+
+# Stored batch responses are replayed for retries within this many days
+IDEMPOTENCY_KEY_DAYS = 7
+
+# User-facing errors for the SQLite constraint a batch item violated, by
+# the kind named at the start of SQLite's message
+CONSTRAINT_ERRORS = (
+    ("CHECK", "Invalid input data"),
+    ("NOT NULL", "Invalid input data"),
+    ("FOREIGN KEY", "Does not match an existing shop, product or category"),
+    ("UNIQUE", "Already submitted"),
+)
+
+
+def ensure_idempotency_keys(db):
+    """Create the table of stored batch responses, keyed per user"""
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+        "user_id INTEGER NOT NULL, "
+        "idempotency_key TEXT NOT NULL, "
+        "response TEXT NOT NULL, "
+        "created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+        "PRIMARY KEY (user_id, idempotency_key), "
+        "FOREIGN KEY (user_id) REFERENCES users(id)"
+        ")"
+    )
+
+
+def insert_price_report(db, user_id, report):
+    """
+    Insert a validated price report, flag it if its price is an outlier for
+    its alias and fold it into its summary and daily rollup; returns its id
+    """
+    price_report_id = db.execute(
+        "INSERT INTO price_reports (user_id, shop_id, product_alias_id, price_paid, quantity) VALUES (?, ?, ?, ?, ?)",
+        user_id,
+        report['shop_id'],
+        report['product_alias_id'],
+        report['price_paid'],
+        report['quantity'],
+    )
+    score_price_report(db, price_report_id, report['product_alias_id'], report['price_paid'] / report['quantity'])
+    record_price_report(db, price_report_id)
+    record_price_report_day(db, price_report_id)
+    return price_report_id
+
+
+def save_price_report(db, user_id, report):
+    """
+    insert_price_report in its own transaction, so a failure leaves no
+    report and no partly updated flags, summary or rollup; returns its id
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        price_report_id = insert_price_report(db, user_id, report)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return price_report_id
+
+
+def constraint_error(e):
+    """User-facing message for a constraint violation raised by Database.execute"""
+    for kind, message in CONSTRAINT_ERRORS:
+        if str(e).startswith(f"{kind} constraint failed"):
+            return message
+    return "Could not be saved"
+
+
+def prepare_batch(db, items):
+    """
+    Validate every batch item up front.
+
+    Returns one entry per item: (report, quality) where quality is None or
+    (category, data, score), or a string with the reason the item is rejected.
+    """
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict):
+            parsed.append("Each report must be an object")
+            continue
+        try:
+            parsed.append(parse_price_report(
+                item.get('shop_id'), item.get('product_alias_id'), item.get('price_paid'), item.get('quantity', 1)
+            ))
+        except ValueError as e:
+            parsed.append(str(e))
+
+    reports = [report for report in parsed if isinstance(report, dict)]
+    shop_ids = {row['id'] for row in db.execute(
+        "SELECT id FROM shops WHERE id IN (?)", [report['shop_id'] for report in reports]
+    )}
+    categories = {row['id']: row['category'] for row in db.execute(
+        "SELECT pa.id, p.category FROM product_aliases pa JOIN products p ON pa.product_id = p.id WHERE pa.id IN (?)",
+        [report['product_alias_id'] for report in reports]
+    )}
+
+    prepared = []
+    for item, report in zip(items, parsed):
+        if isinstance(report, str):
+            prepared.append(report)
+        elif report['shop_id'] not in shop_ids:
+            prepared.append("Unknown shop")
+        elif report['product_alias_id'] not in categories:
+            prepared.append("Unknown product")
+        elif item.get('quality') is None:
+            prepared.append((report, None))
+        elif not isinstance(item['quality'], dict):
+            prepared.append("Quality must be an object")
+        else:
+            category = categories[report['product_alias_id']]
+            try:
+                data = parse_quality_data(category, item['quality'])
+            except ValueError as e:
+                prepared.append(f"Quality: {e}")
+                continue
+            prepared.append((report, (category, data, SCORERS[category](data))))
+    return prepared
+
+
+def submit_price_report_batch(db, user_id, items, idempotency_key=None):
+    """
+    Validate and save a batch of price reports, each with an optional
+    quality block, in one transaction.
+
+    Items that fail validation or a database constraint are reported with
+    an error and skipped; the rest are committed together. With an
+    idempotency key, the first response is stored and returned again for
+    any retry with the same key. Returns (response, replayed).
+    """
+    prepared = prepare_batch(db, items)
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        if idempotency_key is not None:
+            stored = db.execute(
+                "SELECT response FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?",
+                user_id,
+                idempotency_key
+            )
+            if stored:
+                db.execute("COMMIT")
+                return json.loads(stored[0]['response']), True
+
+        results = []
+        for index, entry in enumerate(prepared):
+            if isinstance(entry, str):
+                results.append({'index': index, 'error': entry})
+                continue
+
+            report, quality = entry
+            db.execute("SAVEPOINT batch_item")
+            result = {'index': index}
+            try:
+                result['id'] = insert_price_report(db, user_id, report)
+                if quality:
+                    category, data, score = quality
+                    result['quality_report_id'], _ = write_quality_report(
+                        db, result['id'], user_id, category, data, score
+                    )
+                db.execute("RELEASE batch_item")
+            except ValueError as e:
+                # Constraint violation: drop just this item
+                print(f"Error in batch item {index}: {e}")
+                db.execute("ROLLBACK TO batch_item")
+                db.execute("RELEASE batch_item")
+                error = constraint_error(e)
+                result = {'index': index, 'error': f"Quality: {error}" if 'id' in result else error}
+            results.append(result)
+
+        response = {
+            'results': results,
+            'created': sum(1 for result in results if 'id' in result),
+            'failed': sum(1 for result in results if 'error' in result),
+        }
+        if idempotency_key is not None:
+            db.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < datetime('now', ?)",
+                f"-{IDEMPOTENCY_KEY_DAYS} days"
+            )
+            db.execute(
+                "INSERT INTO idempotency_keys (user_id, idempotency_key, response) VALUES (?, ?, ?)",
+                user_id,
+                idempotency_key,
+                json.dumps(response)
+            )
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return response, False
@@ -0,0 +1,176 @@
+import json
+import math
+
+from geo import EARTH_RADIUS_KM, haversine_distance
+from outliers import SUSPECT_REPORT_IDS
+from search_cache import SearchCache
+from sketch import load_sketch, sketch_merge, sketch_quantiles
+
+# Map tiles use the Web Mercator z/x/y scheme of the browse map's base
+# layer. Each tile is split into CELL_GRID x CELL_GRID cells, so a tile
+# holds at most CELL_GRID^2 cells however many reports it covers. A power
+# of two, so a cell is exactly a tile log2(CELL_GRID) zoom levels deeper.
+CELL_GRID = 8
+
+# Deepest zoom served; shops are already apart at street level
+MAX_TILE_ZOOM = 18
+
+# Most tiles one bounding box request may cover
+MAX_BBOX_TILES = 64
+
+# Web Mercator stops short of the poles
+MAX_MERCATOR_LAT = 85.0511287798
+
+# Serialized cells per (database path, product alias, z, x, y, exclude_suspect).
+# Entries cover the circle around the tile, so the search invalidation after
+# a write drops them too
+tile_cache = SearchCache(ttl=300, max_entries=4096, max_bytes=16 * 1024 * 1024)
+
+
+def _world_position(lat, lon, zoom):
+    """(x, y) of a point in tile units at zoom (whole part is the tile)"""
+    lat = max(min(lat, MAX_MERCATOR_LAT), -MAX_MERCATOR_LAT)
+    scale = 2 ** zoom
+    x = (lon + 180.0) / 360.0 * scale
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * scale
+    # The east edge and south pole belong to the last tile
+    return min(x, scale - 1e-9), min(y, scale - 1e-9)
+
+
+def _latitude(y, zoom):
+    """Latitude of the tile-unit y coordinate at zoom"""
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / 2 ** zoom))))
+
+
+def tile_bounds(zoom, x, y):
+    """(min_lat, max_lat, min_lon, max_lon) of tile z/x/y"""
+    scale = 2 ** zoom
+    return _latitude(y + 1, zoom), _latitude(y, zoom), x / scale * 360.0 - 180.0, (x + 1) / scale * 360.0 - 180.0
+
+
+def tiles_for_bbox(bbox, zoom):
+    """
+    The (x, y) tiles at zoom covering a (min_lat, max_lat, min_lon, max_lon)
+    box. Raises ValueError if that is more than MAX_BBOX_TILES tiles,
+    checked from the corner tiles before any are listed.
+    """
+    min_lat, max_lat, min_lon, max_lon = bbox
+    min_x, min_y = (int(value) for value in _world_position(max_lat, min_lon, zoom))
+    max_x, max_y = (int(value) for value in _world_position(min_lat, max_lon, zoom))
+    if max(max_x - min_x + 1, 0) * max(max_y - min_y + 1, 0) > MAX_BBOX_TILES:
+        raise ValueError("Area too large for this zoom level")
+    return [
+        (x, y)
+        for y in range(min_y, max_y + 1)
+        for x in range(min_x, max_x + 1)
+    ]
+
+
+# Shops with a suspect report of product alias ?
+_FLAGGED_SHOPS = (
+    "(SELECT pr.shop_id FROM suspect_price_reports sp "
+    "JOIN price_reports pr ON pr.id = sp.price_report_id "
+    "WHERE pr.product_alias_id = ?)"
+)
+
+
+def price_tile_cells(db, product_alias_id, zoom, x, y, exclude_suspect=False):
+    """
+    Price clusters of tile z/x/y for a product alias: one entry per grid
+    cell with shops reporting it, with the report-weighted centre of its
+    shops, the cell bounds, report and shop counts, and the median, min
+    and max unit price.
+
+    Read from the shop price summaries, so the work grows with the shops
+    in the tile, and the median comes from their merged sketches. With
+    exclude_suspect, shops holding a suspect report are summarised from
+    their other reports instead.
+    """
+    min_lat, max_lat, min_lon, max_lon = tile_bounds(zoom, x, y)
+    summaries_sql = (
+        "SELECT s.latitude, s.longitude, sps.report_count, sps.min_unit_price, sps.max_unit_price, "
+        "sps.unit_price_sketch "
+        "FROM shops_rtree r "
+        "JOIN shops s ON s.id = r.id "
+        "JOIN shop_price_summaries sps ON sps.shop_id = s.id "
+        "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+        "AND sps.product_alias_id = ?"
+    )
+    args = [min_lat, max_lat, min_lon, max_lon, product_alias_id]
+    if exclude_suspect:
+        summaries_sql += (
+            f" AND s.id NOT IN {_FLAGGED_SHOPS} "
+            "UNION ALL "
+            "SELECT s.latitude, s.longitude, COUNT(*), MIN(pr.price_paid / pr.quantity), "
+            "MAX(pr.price_paid / pr.quantity), quantile_sketch(pr.price_paid / pr.quantity) "
+            "FROM shops_rtree r "
+            "JOIN shops s ON s.id = r.id "
+            "JOIN price_reports pr ON pr.shop_id = s.id "
+            "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+            "AND pr.product_alias_id = ? "
+            f"AND s.id IN {_FLAGGED_SHOPS} "
+            f"AND pr.id NOT IN {SUSPECT_REPORT_IDS} "
+            "GROUP BY s.id"
+        )
+        args = [*args, product_alias_id, min_lat, max_lat, min_lon, max_lon, product_alias_id, product_alias_id]
+    rows = db.execute(summaries_sql, *args)
+
+    cells = {}
+    for row in rows:
+        cell_x, cell_y = _world_position(row['latitude'], row['longitude'], zoom)
+        # Shops on a shared edge are counted in one tile only
+        if int(cell_x) != x or int(cell_y) != y:
+            continue
+        key = (int((cell_y - y) * CELL_GRID), int((cell_x - x) * CELL_GRID))
+        cell = cells.get(key)
+        if cell is None:
+            cell = cells[key] = {
+                'lat_sum': 0.0, 'lon_sum': 0.0, 'count': 0, 'shop_count': 0,
+                'min': row['min_unit_price'], 'max': row['max_unit_price'], 'sketch': {},
+            }
+        count = row['report_count']
+        cell['lat_sum'] += row['latitude'] * count
+        cell['lon_sum'] += row['longitude'] * count
+        cell['count'] += count
+        cell['shop_count'] += 1
+        cell['min'] = min(cell['min'], row['min_unit_price'])
+        cell['max'] = max(cell['max'], row['max_unit_price'])
+        sketch_merge(cell['sketch'], load_sketch(row['unit_price_sketch']))
+
+    cell_zoom = zoom + int(math.log2(CELL_GRID))
+    result = []
+    for (row_index, column), cell in sorted(cells.items()):
+        cell_x, cell_y = x * CELL_GRID + column, y * CELL_GRID + row_index
+        result.append({
+            'lat': round(cell['lat_sum'] / cell['count'], 6),
+            'lon': round(cell['lon_sum'] / cell['count'], 6),
+            'bounds': [round(value, 6) for value in tile_bounds(cell_zoom, cell_x, cell_y)],
+            'count': cell['count'],
+            'shop_count': cell['shop_count'],
+            'median_unit_price': sketch_quantiles(cell['sketch'], cell['min'], cell['max'])['p50'],
+            'min_unit_price': round(cell['min'], 2),
+            'max_unit_price': round(cell['max'], 2),
+        })
+    return result
+
+
+def cached_price_tile(db, product_alias_id, zoom, x, y, exclude_suspect=False):
+    """The JSON text of price_tile_cells, from tile_cache when present"""
+    key = (db.path, product_alias_id, zoom, x, y, exclude_suspect)
+    body = tile_cache.get(key)
+    if body is None:
+        body = json.dumps(
+            price_tile_cells(db, product_alias_id, zoom, x, y, exclude_suspect), separators=(",", ":")
+        )
+        min_lat, max_lat, min_lon, max_lon = tile_bounds(zoom, x, y)
+        lat, lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+        if zoom < 3:
+            # Tiles this wide are not inside any circle around their centre
+            radius = math.pi * EARTH_RADIUS_KM
+        else:
+            radius = max(
+                haversine_distance(lat, lon, corner_lat, corner_lon)
+                for corner_lat in (min_lat, max_lat) for corner_lon in (min_lon, max_lon)
+            )
+        tile_cache.put(key, body, lat, lon, radius, product_alias_id=product_alias_id)
+    return body
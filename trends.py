@@ -0,0 +1,206 @@
+import json
+import math
+import statistics
+from datetime import date, timedelta
+
+from archive import ALL_PRICE_REPORTS
+from geo import bounding_box
+
+# Buckets a trend can be reported in: SQL expression turning d.day into the
+# bucket's first day (weeks start on Monday)
+TREND_INTERVALS = {
+    'day': "d.day",
+    'week': "date(d.day, '-6 days', 'weekday 1')",
+}
+
+# Days covered when a trend request gives no start date
+DEFAULT_TREND_DAYS = 365
+
+
+def ensure_price_report_daily(db):
+    """
+    Create the daily price rollup if it is missing, filled from every
+    existing report (archived ones included).
+
+    One row per product alias, day and shop holds the count, sum, minimum
+    and maximum unit price and the day's unit prices as a JSON array, so
+    medians can be computed exactly over any set of rows. The shop column
+    lets trends be limited to a radius or region.
+    """
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'price_report_daily'"
+    )
+    if exists:
+        return
+
+    db.execute(
+        "CREATE TABLE price_report_daily ("
+        "product_alias_id INTEGER NOT NULL, "
+        "day DATE NOT NULL, "
+        "shop_id INTEGER NOT NULL, "
+        "report_count INTEGER NOT NULL, "
+        "unit_price_sum REAL NOT NULL, "
+        "min_unit_price REAL NOT NULL, "
+        "max_unit_price REAL NOT NULL, "
+        "unit_prices TEXT NOT NULL, "
+        "PRIMARY KEY (product_alias_id, day, shop_id), "
+        "FOREIGN KEY (product_alias_id) REFERENCES product_aliases(id), "
+        "FOREIGN KEY (shop_id) REFERENCES shops(id)"
+        ") WITHOUT ROWID"
+    )
+    refill_price_report_daily(db)
+
+
+def rebuild_price_report_daily(db):
+    """Recompute the daily price rollup from all price reports, archived ones included"""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        refill_price_report_daily(db)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+
+def refill_price_report_daily(db):
+    """
+    Replace the daily price rollup with one computed from every price
+    report. Run it inside a transaction.
+    """
+    db.execute("DELETE FROM price_report_daily")
+    db.execute(
+        "INSERT INTO price_report_daily "
+        "(product_alias_id, day, shop_id, report_count, unit_price_sum, min_unit_price, max_unit_price, unit_prices) "
+        "SELECT product_alias_id, date(reported_at), shop_id, COUNT(*), SUM(price_paid / quantity), "
+        "MIN(price_paid / quantity), MAX(price_paid / quantity), json_group_array(price_paid / quantity) "
+        f"FROM {ALL_PRICE_REPORTS} "
+        "GROUP BY product_alias_id, date(reported_at), shop_id"
+    )
+
+
+# Folds grouped (alias, day, shop) rows from a SELECT into the rollup
+_UPSERT_DAILY = (
+    "INSERT INTO price_report_daily "
+    "(product_alias_id, day, shop_id, report_count, unit_price_sum, min_unit_price, max_unit_price, unit_prices) "
+    "SELECT product_alias_id, date(reported_at), shop_id, COUNT(*), SUM(price_paid / quantity), "
+    "MIN(price_paid / quantity), MAX(price_paid / quantity), json_group_array(price_paid / quantity) "
+    "FROM price_reports WHERE {condition} "
+    "GROUP BY product_alias_id, date(reported_at), shop_id "
+    "ON CONFLICT (product_alias_id, day, shop_id) DO UPDATE SET "
+    "report_count = report_count + excluded.report_count, "
+    "unit_price_sum = unit_price_sum + excluded.unit_price_sum, "
+    "min_unit_price = MIN(min_unit_price, excluded.min_unit_price), "
+    "max_unit_price = MAX(max_unit_price, excluded.max_unit_price), "
+    # Splice the two arrays' text rather than re-encoding them as JSON
+    "unit_prices = substr(unit_prices, 1, length(unit_prices) - 1) || ',' || substr(excluded.unit_prices, 2)"
+)
+
+
+def record_price_report_day(db, price_report_id):
+    """Fold a newly inserted price report into the daily price rollup"""
+    db.execute(_UPSERT_DAILY.format(condition="id = ?"), price_report_id)
+
+
+def record_price_report_days_after(db, last_id):
+    """
+    Fold every price report with an id above last_id into the daily
+    rollup; the bulk import counterpart of record_price_report_day.
+    """
+    db.execute(_UPSERT_DAILY.format(condition="id > ?"), last_id)
+
+
+def price_trend(db, product_alias_id, interval='day', start_date=None, end_date=None, bbox=None, radius=None,
+                exclude_suspect=False):
+    """
+    Median, mean, min, max and count of unit prices per day or week.
+
+    start_date and end_date (inclusive) default to the last
+    DEFAULT_TREND_DAYS days; weekly trends start on the Monday of
+    start_date's week. bbox (min_lat, max_lat, min_lon, max_lon)
+    and radius (lat, lon, km) limit the shops included. exclude_suspect
+    takes the suspect reports back out of the buckets they fall in.
+    Returns the buckets in date order; days without reports are left out.
+    """
+    end_date = end_date or date.today()
+    start_date = start_date or end_date - timedelta(days=DEFAULT_TREND_DAYS - 1)
+    if interval == 'week':
+        # Whole weeks only
+        start_date -= timedelta(days=start_date.weekday())
+
+    joins = ""
+    conditions = ""
+    args = [product_alias_id, start_date.isoformat(), end_date.isoformat()]
+    if bbox is not None or radius is not None:
+        joins = "JOIN shops_rtree r ON r.id = d.shop_id JOIN shops s ON s.id = d.shop_id "
+    if bbox is not None:
+        conditions += "AND r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+        args.extend(bbox)
+    if radius is not None:
+        lat, lon, km = radius
+        conditions += "AND r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+        args.extend(bounding_box(lat, lon, km))
+        conditions += "AND haversine(?, ?, s.latitude, s.longitude) <= ? "
+        args.extend([lat, lon, km])
+
+    rows = db.execute(
+        f"SELECT {TREND_INTERVALS[interval]} AS period, d.report_count, d.unit_price_sum, "
+        "d.min_unit_price, d.max_unit_price, d.unit_prices "
+        "FROM price_report_daily d "
+        + joins
+        + "WHERE d.product_alias_id = ? AND d.day BETWEEN ? AND ? "
+        + conditions
+        + "ORDER BY period",
+        *args
+    )
+
+    buckets = {}
+    for row in rows:
+        bucket = buckets.get(row['period'])
+        if bucket is None:
+            bucket = buckets[row['period']] = {
+                'count': 0, 'sum': 0.0, 'min': row['min_unit_price'], 'max': row['max_unit_price'], 'prices': [],
+            }
+        bucket['count'] += row['report_count']
+        bucket['sum'] += row['unit_price_sum']
+        bucket['min'] = min(bucket['min'], row['min_unit_price'])
+        bucket['max'] = max(bucket['max'], row['max_unit_price'])
+        bucket['prices'].append(row['unit_prices'][1:-1])
+
+    # Suspect prices, encoded as the rollup's arrays encode them so they
+    # compare equal once decoded
+    suspect_prices = {}
+    if exclude_suspect:
+        suspects = db.execute(
+            f"SELECT {TREND_INTERVALS[interval]} AS period, d.unit_price "
+            "FROM (SELECT pr.product_alias_id, date(pr.reported_at) AS day, pr.shop_id, "
+            "json_array(pr.price_paid / pr.quantity) AS unit_price "
+            "FROM suspect_price_reports sp "
+            f"JOIN {ALL_PRICE_REPORTS} pr ON pr.id = sp.price_report_id) d "
+            + joins
+            + "WHERE d.product_alias_id = ? AND d.day BETWEEN ? AND ? "
+            + conditions,
+            *args
+        )
+        for suspect in suspects:
+            suspect_prices.setdefault(suspect['period'], []).extend(json.loads(suspect['unit_price']))
+
+    points = []
+    for period, bucket in buckets.items():
+        # Each bucket's arrays are decoded as one
+        prices = json.loads("[" + ",".join(bucket['prices']) + "]")
+        if period in suspect_prices:
+            for price in suspect_prices[period]:
+                if price in prices:
+                    prices.remove(price)
+            if not prices:
+                continue
+            bucket.update(count=len(prices), sum=math.fsum(prices), min=min(prices), max=max(prices))
+        points.append({
+            'period': period,
+            'count': bucket['count'],
+            'median': round(statistics.median(prices), 2),
+            'mean': round(bucket['sum'] / bucket['count'], 2),
+            'min': round(bucket['min'], 2),
+            'max': round(bucket['max'], 2),
+        })
+    return points
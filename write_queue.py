@@ -0,0 +1,162 @@
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from submissions import insert_price_report
+
+
+class GroupCommitWriter:
+    """
+    Write-behind queue that commits price reports in batches.
+
+    Requests hand their validated report to submit(), which blocks until
+    the batch holding it is committed. A single writer thread takes every
+    report queued while it was busy (up to max_batch, optionally waiting
+    max_delay seconds for more) and inserts them in one transaction, so a
+    burst of submissions pays for one commit (and one fsync) instead of
+    one each.
+
+    The queue holds at most max_queue reports; when it is full, submit()
+    waits up to enqueue_timeout seconds and then raises queue.Full so the
+    caller can shed load.
+    """
+
+    def __init__(self, db, max_batch=200, max_delay=0.0, max_queue=2000, enqueue_timeout=1.0):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'rows': 0,
+            'failed_rows': 0,
+            'rejected_full': 0,
+            'flush_ms_total': 0.0,
+            'flush_ms_max': 0.0,
+            'last_flush_ms': None,
+            'last_batch_size': None,
+        }
+
+    def start(self):
+        """Start the writer thread if it is not running"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="price-report-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, user_id, report, timeout=30.0):
+        """
+        Queue a validated price report and wait until it is committed.
+
+        Returns the new price report id. Raises queue.Full under
+        backpressure, ValueError if the report violates a constraint, and
+        TimeoutError if the batch is not committed within timeout seconds;
+        the report is still queued then and may yet be committed.
+        """
+        self.start()
+        item = {'user_id': user_id, 'report': report, 'done': threading.Event(), 'id': None, 'error': None}
+        try:
+            self._queue.put(item, timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['rejected_full'] += 1
+            raise
+
+        if not item['done'].wait(timeout):
+            raise TimeoutError("Price report was not committed in time")
+        if item['error'] is not None:
+            raise item['error']
+        return item['id']
+
+    def _run(self):
+        # Batched commits are what make full fsyncs affordable here
+        self.db.execute("PRAGMA synchronous = FULL")
+        while True:
+            batch = [self._queue.get()]
+            # Take everything that queued up during the last flush, then
+            # optionally linger up to max_delay for more
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        db = self.db
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for item in batch:
+                    db.execute("SAVEPOINT queued_report")
+                    try:
+                        item['id'] = insert_price_report(db, item['user_id'], item['report'])
+                        db.execute("RELEASE queued_report")
+                    except ValueError as e:
+                        # Constraint violation: fail just this report
+                        db.execute("ROLLBACK TO queued_report")
+                        db.execute("RELEASE queued_report")
+                        item['error'] = e
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            for item in batch:
+                item['id'], item['error'] = None, RuntimeError(f"Batch commit failed: {e}")
+
+        flush_ms = (time.perf_counter() - started) * 1000
+        failed = sum(1 for item in batch if item['error'] is not None)
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['rows'] += len(batch) - failed
+            self._stats['failed_rows'] += failed
+            self._stats['flush_ms_total'] += flush_ms
+            self._stats['flush_ms_max'] = max(self._stats['flush_ms_max'], flush_ms)
+            self._stats['last_flush_ms'] = flush_ms
+            self._stats['last_batch_size'] = len(batch)
+
+        for item in batch:
+            item['done'].set()
+
+    def stats(self):
+        """Queue depth and flush counters for monitoring"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats.pop('batches')
+        flush_ms_total = stats.pop('flush_ms_total')
+        stats.update({
+            'running': self._thread is not None and self._thread.is_alive(),
+            'queue_depth': self._queue.qsize(),
+            'max_queue': self._queue.maxsize,
+            'max_batch': self.max_batch,
+            'max_delay_ms': self.max_delay * 1000,
+            'batches': batches,
+            'avg_batch_size': round((stats['rows'] + stats['failed_rows']) / batches, 2) if batches else None,
+            'avg_flush_ms': round(flush_ms_total / batches, 3) if batches else None,
+        })
+        return stats
+
+
+def current_price_report_writer():
+    """
+    The current app's writer, used by create_price_report when the app runs
+    with WRITE_BEHIND enabled; create_app sets one up per app
+    """
+    return current_app.extensions['price_report_writer']